@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 import json
 from pathlib import Path
@@ -27,23 +28,118 @@ DB_PORT = int(os.getenv("DB_PORT", 5432))
 DB_NAME = os.getenv("DB_NAME", "tiktok_data")
 DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "postgres")
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 30))  # Seconds
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", 300))  # Seconds
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))  # Prepared statements per connection
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", 60))  # Seconds
 
 # Kafka Configuration
 KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092")
 KAFKA_TOPIC = os.getenv("KAFKA_TOPIC", "tiktok-data")
+KAFKA_ACKS = os.getenv("KAFKA_ACKS", "all")
+KAFKA_ACKS = KAFKA_ACKS if KAFKA_ACKS == "all" else int(KAFKA_ACKS)
+KAFKA_LINGER_MS = int(os.getenv("KAFKA_LINGER_MS", 50))  # Wait this long for a batch to fill
+KAFKA_BATCH_SIZE = int(os.getenv("KAFKA_BATCH_SIZE", 256 * 1024))  # Bytes per partition batch
+KAFKA_COMPRESSION_TYPE = os.getenv("KAFKA_COMPRESSION_TYPE", "gzip").lower()  # gzip, snappy, lz4, zstd or none
+KAFKA_COMPRESSION_TYPE = None if KAFKA_COMPRESSION_TYPE == "none" else KAFKA_COMPRESSION_TYPE
+KAFKA_FLUSH_TIMEOUT = float(os.getenv("KAFKA_FLUSH_TIMEOUT", 60.0))  # Seconds
+KAFKA_WIRE_FORMAT = os.getenv("KAFKA_WIRE_FORMAT", "msgpack")  # msgpack (schema ID + values) or json
+KAFKA_DELIVERY = os.getenv("KAFKA_DELIVERY", "idempotent")  # at_least_once, idempotent or transactional
+KAFKA_TRANSACTIONAL_ID = os.getenv("KAFKA_TRANSACTIONAL_ID")  # Defaults to tiktok-etl-<WORKER_ID>
+KAFKA_PUBLISH_SNAPSHOTS = os.getenv("KAFKA_PUBLISH_SNAPSHOTS", "true").lower() == "true"  # Every poll of a video, not only new videos
+SCHEMA_REGISTRY_PATH = os.getenv("SCHEMA_REGISTRY_PATH", str(BASE_DIR / "schemas" / "registry.json"))
 
 # Monitoring Configuration
 PROMETHEUS_PORT = int(os.getenv("PROMETHEUS_PORT", 8001))
 
 # ETL Configuration
 ETL_SCHEDULE_INTERVAL = int(os.getenv("ETL_SCHEDULE_INTERVAL", 60))  # Minutes
+USER_REFRESH_INTERVAL = int(os.getenv("USER_REFRESH_INTERVAL", 3600))  # Seconds, one-off runs skip users updated more recently
 ETL_RETRY_COUNT = int(os.getenv("ETL_RETRY_COUNT", 3))
 ETL_RETRY_DELAY = int(os.getenv("ETL_RETRY_DELAY", 5))  # Seconds
 MAX_WORKERS = int(os.getenv("MAX_WORKERS", 2))
+VIDEO_PAGE_SIZE = int(os.getenv("VIDEO_PAGE_SIZE", 30))
+VIDEO_MAX_PAGES = int(os.getenv("VIDEO_MAX_PAGES", 100))  # 0 = no limit
+VIDEO_SNAPSHOT_MAX_AGE = int(os.getenv("VIDEO_SNAPSHOT_MAX_AGE", 7))  # Days, videos this young are re-polled for hourly snapshots; 0 = new videos only
+
+# Distributed Worker Configuration
+ACCOUNT_LEASES_ENABLED = os.getenv("ACCOUNT_LEASES_ENABLED", "false").lower() == "true"
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+ACCOUNT_LEASE_TTL = int(os.getenv("ACCOUNT_LEASE_TTL", 300))  # Seconds, renewed while the worker is alive
+ACCOUNT_LEASE_BATCH = int(os.getenv("ACCOUNT_LEASE_BATCH", 20))  # Accounts claimed at a time
+
+# Adaptive Polling Configuration
+POLL_MIN_INTERVAL = int(os.getenv("POLL_MIN_INTERVAL", 600))  # Seconds
+POLL_MAX_INTERVAL = int(os.getenv("POLL_MAX_INTERVAL", 21600))  # Seconds
+POLL_TARGET_VIEWS = int(os.getenv("POLL_TARGET_VIEWS", 10000))  # View growth that is worth one poll
+POLL_BATCH_WINDOW = int(os.getenv("POLL_BATCH_WINDOW", 60))  # Seconds, accounts due this close together share a poll
+
+# Streaming Pipeline Configuration
+STREAMING_PIPELINE = os.getenv("STREAMING_PIPELINE", "false").lower() == "true"
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", 100))  # Items buffered in front of each stage
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 1000))  # Videos per load transaction
+STREAM_TRANSFORM_WORKERS = int(os.getenv("STREAM_TRANSFORM_WORKERS", 1))
+STREAM_LOAD_WORKERS = int(os.getenv("STREAM_LOAD_WORKERS", 2))  # Concurrent load transactions
+
+# Spark Streaming Consumer Configuration
+SPARK_CHECKPOINT_DIR = os.getenv("SPARK_CHECKPOINT_DIR", str(STATE_DIR / "spark_checkpoints"))
+SPARK_TRIGGER_INTERVAL = os.getenv("SPARK_TRIGGER_INTERVAL", "10 seconds")
+SPARK_SINK_PARTITIONS = int(os.getenv("SPARK_SINK_PARTITIONS", 4))  # Concurrent COPY connections per micro-batch
+SPARK_WINDOWS = os.getenv("SPARK_WINDOWS", "6 hours/1 hour,1 day")  # "duration" tumbles, "duration/slide" slides
+SPARK_WATERMARK = os.getenv("SPARK_WATERMARK", "1 hour")  # How late a snapshot may arrive before its window is emitted
+SPARK_RAW_SINK = os.getenv("SPARK_RAW_SINK", "false").lower() == "true"  # Also keep every message in video_metrics_realtime
+SPARK_METRICS_PORT = int(os.getenv("SPARK_METRICS_PORT", 8002))
+
+# API backend: "tiktokapi" (Playwright-backed TikTokApi) or "fake" (offline fixtures)
+TIKTOK_API_BACKEND = os.getenv("TIKTOK_API_BACKEND", "tiktokapi")
+FAKE_API_LATENCY_MS = float(os.getenv("FAKE_API_LATENCY_MS", 200))
+FAKE_API_LATENCY_JITTER = float(os.getenv("FAKE_API_LATENCY_JITTER", 0.3))
+FAKE_API_429_RATE = float(os.getenv("FAKE_API_429_RATE", 0.0))
+FAKE_API_503_RATE = float(os.getenv("FAKE_API_503_RATE", 0.0))
+FAKE_API_VIDEOS_PER_ACCOUNT = int(os.getenv("FAKE_API_VIDEOS_PER_ACCOUNT", 60))
+FAKE_API_SEED = int(os.getenv("FAKE_API_SEED", 42))
+FAKE_API_EPOCH = int(os.getenv("FAKE_API_EPOCH", 1767225600))  # Unix time of the newest generated video
+
+# Session Pool Configuration
+API_SESSION_POOL_SIZE = int(os.getenv("API_SESSION_POOL_SIZE", 1))
+API_SESSION_SLOW_THRESHOLD = float(os.getenv("API_SESSION_SLOW_THRESHOLD", 30.0))  # Seconds
+API_SESSION_MAX_ERRORS = int(os.getenv("API_SESSION_MAX_ERRORS", 3))
+API_SESSION_LEASE_TIMEOUT = float(os.getenv("API_SESSION_LEASE_TIMEOUT", 120.0))  # Seconds
+API_SESSION_RESTART_DELAY = float(os.getenv("API_SESSION_RESTART_DELAY", 5.0))  # Seconds before the first retry of a failed restart, doubled per attempt
+API_SESSION_RESTART_MAX_DELAY = float(os.getenv("API_SESSION_RESTART_MAX_DELAY", 300.0))  # Seconds
+API_SESSION_PERSIST_STATE = os.getenv("API_SESSION_PERSIST_STATE", "true").lower() == "true"  # Restore browser cookies from CACHE_DIR on restart
+
+# Rate Limit Configuration
+API_RATE_LIMIT = float(os.getenv("API_RATE_LIMIT", 1.0))  # Requests per second per endpoint
+API_RATE_LIMIT_BURST = float(os.getenv("API_RATE_LIMIT_BURST", 5))
+API_RATE_LIMIT_MIN = float(os.getenv("API_RATE_LIMIT_MIN", 0.1))
+API_RATE_LIMIT_MAX = float(os.getenv("API_RATE_LIMIT_MAX", 10.0))
+API_RATE_LIMIT_INCREASE = float(os.getenv("API_RATE_LIMIT_INCREASE", 0.05))
+API_RATE_LIMIT_DECREASE = float(os.getenv("API_RATE_LIMIT_DECREASE", 0.5))
 
 # Cache Configuration
 TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", 3600))  # 1 hour
+TOKEN_REFRESH_ENABLED = os.getenv("TOKEN_REFRESH_ENABLED", "false").lower() == "true"  # Needs a profile logged in by get_tokens.py
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", 300))  # Seconds before TOKEN_CACHE_TTL runs out
+TOKEN_PROFILE_DIR = CACHE_DIR / "token_profile"
 API_RESPONSE_CACHE_TTL = int(os.getenv("API_RESPONSE_CACHE_TTL", 300))  # 5 minutes
+API_RESPONSE_CACHE_MAX_BYTES = int(os.getenv("API_RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+API_RESPONSE_CACHE_PERSIST = os.getenv("API_RESPONSE_CACHE_PERSIST", "true").lower() == "true"
+API_RESPONSE_CACHE_FLUSH_INTERVAL = int(os.getenv("API_RESPONSE_CACHE_FLUSH_INTERVAL", 30))  # Seconds
+
+# Deduplication Configuration
+DEDUP_INDEX_BACKEND = os.getenv("DEDUP_INDEX_BACKEND", "bloom")  # bloom, store or memory
+DEDUP_INDEX_CAPACITY = int(os.getenv("DEDUP_INDEX_CAPACITY", 10_000_000))
+DEDUP_INDEX_ERROR_RATE = float(os.getenv("DEDUP_INDEX_ERROR_RATE", 0.01))
+
+# Partition Maintenance Configuration
+PARTITION_PREMAKE = int(os.getenv("PARTITION_PREMAKE", 3))  # Periods created ahead of the current one
+PARTITION_MAINTENANCE_INTERVAL = int(os.getenv("PARTITION_MAINTENANCE_INTERVAL", 360))  # Minutes
+PARTITION_DROP_EXPIRED = os.getenv("PARTITION_DROP_EXPIRED", "false").lower() == "true"
+VIDEO_METRICS_PARTITION_PERIOD = os.getenv("VIDEO_METRICS_PARTITION_PERIOD", "1 month")
+VIDEO_METRICS_RETENTION = os.getenv("VIDEO_METRICS_RETENTION") or None  # e.g. "12 months", unset keeps all
 
 # Logging Configuration
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
@@ -64,6 +160,31 @@ def get_target_accounts():
     else:
         return get_default_accounts()
 
+def get_session_token_sets():
+    token_sets_json = os.getenv("TIKTOK_SESSION_TOKENS")
+    if not token_sets_json:
+        return []
+    try:
+        return [
+            {
+                "ms_token": token_set.get("ms_token"),
+                "verify_fp": token_set.get("verify_fp"),
+                "session_id": token_set.get("session_id")
+            }
+            for token_set in json.loads(token_sets_json)
+        ]
+    except (json.JSONDecodeError, AttributeError, TypeError):
+        return []
+
+def get_endpoint_rate_limits():
+    limits_json = os.getenv("API_ENDPOINT_RATE_LIMITS")
+    if not limits_json:
+        return {}
+    try:
+        return {endpoint: float(rate) for endpoint, rate in json.loads(limits_json).items()}
+    except (json.JSONDecodeError, AttributeError, TypeError, ValueError):
+        return {}
+
 def get_default_accounts():
     return {
         "obschestvoznaika_el": "https://www.tiktok.com/@obschestvoznaika_el",
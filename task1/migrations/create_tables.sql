@@ -19,55 +19,206 @@ CREATE TABLE IF NOT EXISTS videos (
     user_id VARCHAR(255) REFERENCES users(id),
     caption TEXT,
     create_time TIMESTAMP,
-    like_count INTEGER,
-    comment_count INTEGER,
-    view_count INTEGER,
-    share_count INTEGER,
+    like_count BIGINT,
+    comment_count BIGINT,
+    view_count BIGINT,
+    share_count BIGINT,
     collected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- The view reads these columns and blocks the type change, it is created again at the end
+DROP VIEW IF EXISTS video_engagement;
+
+-- Tables created with INTEGER counters overflow on popular videos, a no-op once they are BIGINT
+ALTER TABLE videos
+    ALTER COLUMN like_count TYPE BIGINT,
+    ALTER COLUMN comment_count TYPE BIGINT,
+    ALTER COLUMN view_count TYPE BIGINT,
+    ALTER COLUMN share_count TYPE BIGINT;
+
 -- Create index on user_id for faster joins
 CREATE INDEX IF NOT EXISTS idx_videos_user_id ON videos(user_id);
 
 -- Create index on create_time for time-based queries
 CREATE INDEX IF NOT EXISTS idx_videos_create_time ON videos(create_time);
 
--- video_metrics_hourly table - partitioned by day
+-- Work leases that split target accounts between pipeline workers
+CREATE TABLE IF NOT EXISTS account_leases (
+    username VARCHAR(255) PRIMARY KEY,
+    url TEXT,
+    worker_id VARCHAR(255),
+    leased_until TIMESTAMPTZ,
+    last_completed_at TIMESTAMPTZ,
+    video_watermark BIGINT,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+
+-- Claims scan for free or expired leases, oldest completion first
+CREATE INDEX IF NOT EXISTS idx_account_leases_claim ON account_leases(last_completed_at NULLS FIRST, leased_until);
+
+-- video_metrics_hourly table - partitioned by month
 CREATE TABLE IF NOT EXISTS video_metrics_hourly (
     id SERIAL,
     video_id VARCHAR(255) REFERENCES videos(id),
     hour TIMESTAMP,
-    like_count INTEGER,
-    comment_count INTEGER,
-    view_count INTEGER,
-    share_count INTEGER,
+    like_count BIGINT,
+    comment_count BIGINT,
+    view_count BIGINT,
+    share_count BIGINT,
     collected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     PRIMARY KEY (id, hour)
 ) PARTITION BY RANGE (hour);
 
--- Create partitions for the next 12 months
-DO $$
-DECLARE
-    i INTEGER;
-    partition_name TEXT;
-    start_date DATE;
-    end_date DATE;
-BEGIN
-    FOR i IN 0..11 LOOP
-        start_date := CURRENT_DATE + (i * INTERVAL '1 month');
-        end_date := CURRENT_DATE + ((i + 1) * INTERVAL '1 month');
-        partition_name := 'video_metrics_hourly_' || to_char(start_date, 'YYYY_MM');
-        
-        EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF video_metrics_hourly 
-                        FOR VALUES FROM (%L) TO (%L)',
-                       partition_name, start_date, end_date);
-    END LOOP;
-END $$;
+ALTER TABLE video_metrics_hourly
+    ALTER COLUMN like_count TYPE BIGINT,
+    ALTER COLUMN comment_count TYPE BIGINT,
+    ALTER COLUMN view_count TYPE BIGINT,
+    ALTER COLUMN share_count TYPE BIGINT;
+
+-- Rows outside the monthly partitions land here until maintain_range_partitions moves them out
+CREATE TABLE IF NOT EXISTS video_metrics_hourly_default PARTITION OF video_metrics_hourly DEFAULT;
+
+-- Monthly partitions aligned to calendar months (functions from partition_maintenance.sql)
+SELECT * FROM maintain_range_partitions('video_metrics_hourly', INTERVAL '1 month', 3);
 
 -- Create indices for the partitioned table
-CREATE INDEX IF NOT EXISTS idx_video_metrics_hourly_video_id ON video_metrics_hourly(video_id);
+-- One snapshot per video and hour, also serves lookups by video_id
+DROP INDEX IF EXISTS idx_video_metrics_hourly_video_id;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_video_metrics_hourly_video_hour ON video_metrics_hourly(video_id, hour);
 CREATE INDEX IF NOT EXISTS idx_video_metrics_hourly_hour ON video_metrics_hourly(hour);
 
+-- Engagement score, shared by the view and the rollup tables
+CREATE OR REPLACE FUNCTION engagement_score(likes BIGINT, comments BIGINT, shares BIGINT, views BIGINT)
+RETURNS DOUBLE PRECISION
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE
+        WHEN views > 0 THEN (coalesce(likes, 0) * 2 + coalesce(comments, 0) * 3 + coalesce(shares, 0) * 5)::FLOAT / views
+        ELSE 0
+    END
+$$;
+
+-- Engagement rollups, refreshed by the load stage for the keys of each batch
+-- Per video and hour: counters of the hourly snapshot and growth since the previous one
+CREATE TABLE IF NOT EXISTS video_engagement_hourly (
+    video_id VARCHAR(255) NOT NULL,
+    hour TIMESTAMP NOT NULL,
+    user_id VARCHAR(255) NOT NULL,
+    like_count BIGINT,
+    comment_count BIGINT,
+    view_count BIGINT,
+    share_count BIGINT,
+    likes_gained BIGINT,
+    views_gained BIGINT,
+    engagement_score DOUBLE PRECISION,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (video_id, hour)
+) PARTITION BY RANGE (hour);
+
+-- Tables created with INTEGER counters overflow on popular videos, a no-op once they are BIGINT
+ALTER TABLE video_engagement_hourly
+    ALTER COLUMN like_count TYPE BIGINT,
+    ALTER COLUMN comment_count TYPE BIGINT,
+    ALTER COLUMN view_count TYPE BIGINT,
+    ALTER COLUMN share_count TYPE BIGINT,
+    ALTER COLUMN likes_gained TYPE BIGINT,
+    ALTER COLUMN views_gained TYPE BIGINT;
+
+CREATE TABLE IF NOT EXISTS video_engagement_hourly_default PARTITION OF video_engagement_hourly DEFAULT;
+SELECT * FROM maintain_range_partitions('video_engagement_hourly', INTERVAL '1 month', 3);
+CREATE INDEX IF NOT EXISTS idx_video_engagement_hourly_user_hour ON video_engagement_hourly(user_id, hour);
+
+-- Counters of every video message seen by the Spark consumer (src/stream_sink.py)
+-- observed_at is the Kafka record timestamp, a replayed micro-batch upserts the same keys
+CREATE TABLE IF NOT EXISTS video_metrics_realtime (
+    video_id VARCHAR(255) NOT NULL,
+    observed_at TIMESTAMP NOT NULL,
+    user_id VARCHAR(255),
+    like_count BIGINT,
+    comment_count BIGINT,
+    view_count BIGINT,
+    share_count BIGINT,
+    engagement_score DOUBLE PRECISION,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (video_id, observed_at)
+) PARTITION BY RANGE (observed_at);
+
+CREATE TABLE IF NOT EXISTS video_metrics_realtime_default PARTITION OF video_metrics_realtime DEFAULT;
+SELECT * FROM maintain_range_partitions('video_metrics_realtime', INTERVAL '1 month', 3);
+CREATE INDEX IF NOT EXISTS idx_video_metrics_realtime_observed_at ON video_metrics_realtime(observed_at);
+
+-- Event-time windows of the Spark consumer: counters at the last snapshot and growth within the window
+-- Tumbling and sliding windows share the table, window_end - window_start tells them apart
+CREATE TABLE IF NOT EXISTS video_engagement_window (
+    video_id VARCHAR(255) NOT NULL,
+    window_start TIMESTAMP NOT NULL,
+    window_end TIMESTAMP NOT NULL,
+    user_id VARCHAR(255) NOT NULL,
+    snapshots INTEGER,
+    like_count BIGINT,
+    comment_count BIGINT,
+    view_count BIGINT,
+    share_count BIGINT,
+    likes_gained BIGINT,
+    views_gained BIGINT,
+    shares_gained BIGINT,
+    engagement_score DOUBLE PRECISION,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (video_id, window_start, window_end)
+) PARTITION BY RANGE (window_start);
+
+CREATE TABLE IF NOT EXISTS video_engagement_window_default PARTITION OF video_engagement_window DEFAULT;
+SELECT * FROM maintain_range_partitions('video_engagement_window', INTERVAL '1 month', 3);
+CREATE INDEX IF NOT EXISTS idx_video_engagement_window_user ON video_engagement_window(user_id, window_start, window_end);
+
+-- Per user and window, refreshed from video_engagement_window by the same micro-batch
+CREATE TABLE IF NOT EXISTS user_engagement_window (
+    user_id VARCHAR(255) NOT NULL,
+    window_start TIMESTAMP NOT NULL,
+    window_end TIMESTAMP NOT NULL,
+    video_count INTEGER,
+    like_count BIGINT,
+    comment_count BIGINT,
+    view_count BIGINT,
+    share_count BIGINT,
+    likes_gained BIGINT,
+    views_gained BIGINT,
+    shares_gained BIGINT,
+    engagement_score DOUBLE PRECISION,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, window_start, window_end)
+);
+
+-- Per user and day / week: latest counters of each video in the period and growth within it
+CREATE TABLE IF NOT EXISTS user_engagement_daily (
+    user_id VARCHAR(255) NOT NULL REFERENCES users(id),
+    day DATE NOT NULL,
+    video_count INTEGER,
+    like_count BIGINT,
+    comment_count BIGINT,
+    view_count BIGINT,
+    share_count BIGINT,
+    likes_gained BIGINT,
+    views_gained BIGINT,
+    engagement_score DOUBLE PRECISION,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, day)
+);
+
+CREATE TABLE IF NOT EXISTS user_engagement_weekly (
+    user_id VARCHAR(255) NOT NULL REFERENCES users(id),
+    week DATE NOT NULL,
+    video_count INTEGER,
+    like_count BIGINT,
+    comment_count BIGINT,
+    view_count BIGINT,
+    share_count BIGINT,
+    likes_gained BIGINT,
+    views_gained BIGINT,
+    engagement_score DOUBLE PRECISION,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, week)
+);
+
 -- Create view for engagement metrics
 CREATE OR REPLACE VIEW video_engagement AS
 SELECT 
@@ -80,10 +231,6 @@ SELECT
     v.comment_count,
     v.view_count,
     v.share_count,
-    CASE 
-        WHEN v.view_count > 0 THEN 
-            (v.like_count * 2 + v.comment_count * 3 + v.share_count * 5)::FLOAT / v.view_count
-        ELSE 0 
-    END as engagement_score
+    engagement_score(v.like_count, v.comment_count, v.share_count, v.view_count) as engagement_score
 FROM videos v
 JOIN users u ON v.user_id = u.id; 
\ No newline at end of file
@@ -0,0 +1,183 @@
+-- Partition lifecycle for tables range partitioned on a single DATE or TIMESTAMP column
+
+-- Partition key column of a range partitioned table
+CREATE OR REPLACE FUNCTION range_partition_key(p_parent REGCLASS)
+RETURNS TEXT
+LANGUAGE sql STABLE AS $$
+    SELECT a.attname::TEXT
+    FROM pg_partitioned_table pt
+    JOIN pg_attribute a ON a.attrelid = pt.partrelid AND a.attnum = pt.partattrs[0]
+    WHERE pt.partrelid = p_parent AND pt.partstrat = 'r' AND pt.partnatts = 1
+$$;
+
+-- Partitions with their bounds, the DEFAULT partition has NULL bounds
+CREATE OR REPLACE FUNCTION range_partitions(p_parent REGCLASS)
+RETURNS TABLE (partition REGCLASS, lower_bound TIMESTAMP, upper_bound TIMESTAMP, is_default BOOLEAN)
+LANGUAGE sql STABLE AS $$
+    SELECT c.oid::REGCLASS,
+           substring(pg_get_expr(c.relpartbound, c.oid) FROM $re$FROM \('([^']+)'\)$re$)::TIMESTAMP,
+           substring(pg_get_expr(c.relpartbound, c.oid) FROM $re$TO \('([^']+)'\)$re$)::TIMESTAMP,
+           pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT'
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = p_parent
+$$;
+
+-- Creates a partition for [p_from, p_to). Rows of that range already sitting in the DEFAULT
+-- partition are moved into the new table first, otherwise the partition could not be attached.
+-- Returns the number of moved rows.
+CREATE OR REPLACE FUNCTION create_range_partition(p_parent REGCLASS, p_name TEXT, p_from TIMESTAMP, p_to TIMESTAMP)
+RETURNS BIGINT
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_schema TEXT;
+    v_column TEXT := range_partition_key(p_parent);
+    v_columns TEXT;
+    v_default REGCLASS;
+    v_has_rows BOOLEAN := FALSE;
+    v_rows BIGINT;
+BEGIN
+    SELECT n.nspname INTO v_schema
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.oid = p_parent;
+
+    SELECT partition INTO v_default FROM range_partitions(p_parent) WHERE is_default;
+    IF v_default IS NOT NULL THEN
+        EXECUTE format('SELECT EXISTS (SELECT 1 FROM %s WHERE %I >= %L AND %I < %L)',
+                       v_default, v_column, p_from, v_column, p_to)
+        INTO v_has_rows;
+    END IF;
+
+    IF NOT v_has_rows THEN
+        EXECUTE format('CREATE TABLE %I.%I PARTITION OF %s FOR VALUES FROM (%L) TO (%L)',
+                       v_schema, p_name, p_parent, p_from, p_to);
+        RETURN 0;
+    END IF;
+
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO v_columns
+    FROM pg_attribute
+    WHERE attrelid = p_parent AND attnum > 0 AND NOT attisdropped;
+
+    EXECUTE format('CREATE TABLE %I.%I (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                   v_schema, p_name, p_parent);
+    EXECUTE format('WITH moved AS (DELETE FROM %s WHERE %I >= %L AND %I < %L RETURNING %s) '
+                   'INSERT INTO %I.%I (%s) SELECT %s FROM moved',
+                   v_default, v_column, p_from, v_column, p_to, v_columns,
+                   v_schema, p_name, v_columns, v_columns);
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    EXECUTE format('ALTER TABLE %s ATTACH PARTITION %I.%I FOR VALUES FROM (%L) TO (%L)',
+                   p_parent, v_schema, p_name, p_from, p_to);
+    RETURN v_rows;
+END $$;
+
+-- Covers [p_from, p_to) with partitions, skipping ranges that existing partitions already hold
+CREATE OR REPLACE FUNCTION fill_range_partitions(p_parent REGCLASS, p_from TIMESTAMP, p_to TIMESTAMP, p_format TEXT)
+RETURNS TABLE (partition_name TEXT, action TEXT, row_count BIGINT)
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_table TEXT;
+    v_from TIMESTAMP := p_from;
+    v_to TIMESTAMP;
+    v_covered TIMESTAMP;
+    v_moved BIGINT;
+BEGIN
+    SELECT relname INTO v_table FROM pg_class WHERE oid = p_parent;
+
+    WHILE v_from < p_to LOOP
+        SELECT max(upper_bound) INTO v_covered
+        FROM range_partitions(p_parent)
+        WHERE lower_bound <= v_from AND upper_bound > v_from;
+        IF v_covered IS NOT NULL THEN
+            v_from := v_covered;
+            CONTINUE;
+        END IF;
+
+        SELECT least(p_to, min(lower_bound)) INTO v_to
+        FROM range_partitions(p_parent)
+        WHERE lower_bound > v_from AND lower_bound < p_to;
+
+        partition_name := v_table || '_' || to_char(v_from, p_format);
+        IF to_regclass(quote_ident(partition_name)) IS NOT NULL THEN
+            partition_name := v_table || '_' || to_char(v_from, 'YYYYMMDD_HH24MI');
+        END IF;
+        v_moved := create_range_partition(p_parent, partition_name, v_from, v_to);
+        action := CASE WHEN v_moved > 0 THEN 'split_from_default' ELSE 'created' END;
+        row_count := v_moved;
+        RETURN NEXT;
+        v_from := v_to;
+    END LOOP;
+END $$;
+
+-- Creates p_premake partitions ahead of the current period, moves rows out of the DEFAULT
+-- partition into proper ranges and detaches (or drops) partitions older than p_retention.
+-- Returns one row per partition it changed.
+CREATE OR REPLACE FUNCTION maintain_range_partitions(
+    p_parent REGCLASS,
+    p_period INTERVAL DEFAULT INTERVAL '1 month',
+    p_premake INTEGER DEFAULT 3,
+    p_retention INTERVAL DEFAULT NULL,
+    p_drop_expired BOOLEAN DEFAULT FALSE
+)
+RETURNS TABLE (partition_name TEXT, action TEXT, row_count BIGINT)
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_column TEXT := range_partition_key(p_parent);
+    v_unit TEXT;
+    v_format TEXT;
+    v_current TIMESTAMP;
+    v_start TIMESTAMP;
+    v_default REGCLASS;
+    v_expired RECORD;
+BEGIN
+    IF v_column IS NULL THEN
+        RAISE EXCEPTION '% is not range partitioned on a single column', p_parent;
+    END IF;
+
+    -- Concurrent runs for the same table would race on CREATE/ATTACH
+    PERFORM pg_advisory_xact_lock(p_parent::OID::BIGINT);
+
+    IF p_period >= INTERVAL '1 month' THEN
+        v_unit := 'month';
+        v_format := 'YYYY_MM';
+    ELSIF p_period >= INTERVAL '1 day' THEN
+        v_unit := 'day';
+        v_format := 'YYYY_MM_DD';
+    ELSE
+        v_unit := 'hour';
+        v_format := 'YYYY_MM_DD_HH24';
+    END IF;
+    -- Partition bounds are UTC, like every timestamp the pipelines write, whatever the session TimeZone
+    v_current := date_trunc(v_unit, now() AT TIME ZONE 'UTC');
+
+    FOR i IN 0..p_premake LOOP
+        RETURN QUERY SELECT * FROM fill_range_partitions(
+            p_parent, v_current + i * p_period, v_current + (i + 1) * p_period, v_format);
+    END LOOP;
+
+    SELECT partition INTO v_default FROM range_partitions(p_parent) WHERE is_default;
+    IF v_default IS NOT NULL THEN
+        FOR v_start IN EXECUTE format('SELECT DISTINCT date_trunc(%L, %I)::TIMESTAMP FROM %s ORDER BY 1',
+                                      v_unit, v_column, v_default) LOOP
+            RETURN QUERY SELECT * FROM fill_range_partitions(p_parent, v_start, v_start + p_period, v_format);
+        END LOOP;
+    END IF;
+
+    IF p_retention IS NOT NULL THEN
+        FOR v_expired IN
+            SELECT partition, upper_bound FROM range_partitions(p_parent)
+            WHERE NOT is_default AND upper_bound <= v_current - p_retention
+            ORDER BY lower_bound
+        LOOP
+            partition_name := v_expired.partition::TEXT;
+            EXECUTE format('ALTER TABLE %s DETACH PARTITION %s', p_parent, v_expired.partition);
+            IF p_drop_expired THEN
+                EXECUTE format('DROP TABLE %s', v_expired.partition);
+                action := 'dropped';
+            ELSE
+                action := 'detached';
+            END IF;
+            row_count := NULL;
+            RETURN NEXT;
+        END LOOP;
+    END IF;
+END $$;
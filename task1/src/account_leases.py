@@ -0,0 +1,127 @@
+import asyncio
+import logging
+from prometheus_client import Counter, Gauge
+
+from config.config import (
+    WORKER_ID, ACCOUNT_LEASE_TTL, ACCOUNT_LEASE_BATCH, ETL_SCHEDULE_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+ACCOUNT_LEASES = Counter('account_leases_total', 'Account lease transitions per worker', ['worker', 'action'])
+ACCOUNT_LEASES_HELD = Gauge('account_leases_held', 'Accounts currently leased by the worker', ['worker'])
+
+class AccountLeases:
+    def __init__(self, database, worker_id=WORKER_ID, lease_ttl=ACCOUNT_LEASE_TTL,
+                 batch_size=ACCOUNT_LEASE_BATCH, refresh_interval=ETL_SCHEDULE_INTERVAL * 60):
+        self.database = database
+        self.worker_id = worker_id
+        self.lease_ttl = lease_ttl
+        self.batch_size = batch_size
+        self.refresh_interval = refresh_interval
+        self.held = set()
+        self._heartbeat = None
+
+    def _record(self, action, count):
+        ACCOUNT_LEASES.labels(worker=self.worker_id, action=action).inc(count)
+        ACCOUNT_LEASES_HELD.labels(worker=self.worker_id).set(len(self.held))
+
+    async def register(self, accounts):
+        async with self.database.acquire() as conn:
+            await conn.executemany(
+                "INSERT INTO account_leases (username, url) VALUES ($1, $2) "
+                "ON CONFLICT (username) DO UPDATE SET url = EXCLUDED.url "
+                "WHERE account_leases.url IS DISTINCT FROM EXCLUDED.url",
+                list(accounts.items())
+            )
+
+    async def claim(self, limit=None):
+        # SKIP LOCKED lets concurrent workers claim disjoint rows without waiting on each other.
+        # Accounts completed within the refresh interval belong to the current cycle and are skipped.
+        async with self.database.acquire() as conn:
+            rows = await conn.fetch("""
+                WITH claimable AS (
+                    SELECT username FROM account_leases
+                    WHERE (leased_until IS NULL OR leased_until < now())
+                      AND (last_completed_at IS NULL OR last_completed_at < now() - make_interval(secs => $3))
+                    ORDER BY last_completed_at NULLS FIRST, username
+                    LIMIT $2
+                    FOR UPDATE SKIP LOCKED
+                )
+                UPDATE account_leases l
+                SET worker_id = $1,
+                    leased_until = now() + make_interval(secs => $4),
+                    attempts = l.attempts + 1
+                FROM claimable
+                WHERE l.username = claimable.username
+                RETURNING l.username, l.url, l.video_watermark
+            """, self.worker_id, limit or self.batch_size, float(self.refresh_interval), float(self.lease_ttl))
+        self.held.update(row["username"] for row in rows)
+        self._record("claimed", len(rows))
+        if rows:
+            logger.info(f"Worker {self.worker_id} claimed {len(rows)} accounts")
+        return rows
+
+    async def renew(self):
+        if not self.held:
+            return
+        async with self.database.acquire() as conn:
+            rows = await conn.fetch(
+                "UPDATE account_leases SET leased_until = now() + make_interval(secs => $3) "
+                "WHERE username = ANY($2::text[]) AND worker_id = $1 RETURNING username",
+                self.worker_id, list(self.held), float(self.lease_ttl)
+            )
+        lost = self.held - {row["username"] for row in rows}
+        if lost:
+            logger.warning(f"Worker {self.worker_id} lost leases on {sorted(lost)}")
+            self.held -= lost
+            self._record("lost", len(lost))
+
+    async def complete(self, watermarks):
+        if not watermarks:
+            return
+        async with self.database.acquire() as conn:
+            await conn.executemany(
+                "UPDATE account_leases SET worker_id = NULL, leased_until = NULL, attempts = 0, "
+                "last_completed_at = now(), "
+                "video_watermark = GREATEST(COALESCE(video_watermark, 0), COALESCE($3, 0)) "
+                "WHERE username = $2 AND worker_id = $1",
+                [(self.worker_id, username, watermark) for username, watermark in watermarks.items()]
+            )
+        self.held -= set(watermarks)
+        self._record("completed", len(watermarks))
+
+    async def release_all(self):
+        if not self.held:
+            return
+        async with self.database.acquire() as conn:
+            await conn.execute(
+                "UPDATE account_leases SET worker_id = NULL, leased_until = NULL "
+                "WHERE username = ANY($2::text[]) AND worker_id = $1",
+                self.worker_id, list(self.held)
+            )
+        logger.info(f"Worker {self.worker_id} released {len(self.held)} unfinished accounts")
+        released = len(self.held)
+        self.held.clear()
+        self._record("released", released)
+
+    async def _renew_forever(self):
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                await self.renew()
+            except Exception as e:
+                logger.error(f"Error renewing account leases: {e}")
+
+    def start_heartbeat(self):
+        if self._heartbeat is None:
+            self._heartbeat = asyncio.ensure_future(self._renew_forever())
+
+    async def stop_heartbeat(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat = None
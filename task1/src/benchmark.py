@@ -0,0 +1,156 @@
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+from config.config import (
+    MAX_WORKERS, API_SESSION_POOL_SIZE, FAKE_API_LATENCY_MS, FAKE_API_429_RATE,
+    FAKE_API_503_RATE, FAKE_API_VIDEOS_PER_ACCOUNT
+)
+from fake_tiktok_api import FakeApiSettings, FakeBackend, FakeTikTokApi
+from rate_limiter import RateLimiter
+from response_cache import ResponseCache
+from state_store import StateStore
+from tiktok_api import TikTokAPIClient
+from etl_pipeline import TikTokETLPipeline
+
+class NullKafkaProducer:
+    def __init__(self):
+        self.sent = 0
+
+    def send_batch(self, records):
+        self.sent += len(records)
+        return len(records)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class BenchmarkPipeline(TikTokETLPipeline):
+    def __init__(self, load=False, **kwargs):
+        self.load = load
+        super().__init__(**kwargs)
+
+    async def _write_batch(self, users, videos):
+        if self.load:
+            return await super()._write_batch(users, videos)
+        return {}, {}, {}
+
+def instrument_calls(api_client):
+    latencies = {}
+    call_endpoint = api_client._call_endpoint
+
+    async def timed_call(endpoint, *args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return await call_endpoint(endpoint, *args, **kwargs)
+        finally:
+            latencies.setdefault(endpoint, []).append(time.perf_counter() - start_time)
+
+    api_client._call_endpoint = timed_call
+    return latencies
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def run_benchmark(args):
+    backend = FakeBackend(FakeApiSettings(
+        latency_ms=args.latency_ms,
+        rate_429=args.rate_429,
+        rate_503=args.rate_503,
+        videos_per_account=args.videos_per_account
+    ))
+    api_client = TikTokAPIClient(
+        rate_limiter=RateLimiter(default_rate=args.rate_limit, endpoint_rates={}),
+        pool_size=args.sessions,
+        response_cache=ResponseCache(path=None) if args.cache else ResponseCache(ttl=0, path=None),
+        api_factory=lambda tokens: FakeTikTokApi(backend)
+    )
+    latencies = instrument_calls(api_client)
+    accounts = {f"bench_user_{i}": None for i in range(args.accounts)}
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        pipeline = BenchmarkPipeline(
+            load=args.load,
+            max_workers=args.workers,
+            api_client=api_client,
+            kafka_producer=NullKafkaProducer(),
+            state_store=StateStore(Path(state_dir) / "pipeline_state.db"),
+            target_accounts=accounts
+        )
+        durations = {}
+        start_time = time.perf_counter()
+        if args.streaming:
+            pipeline.run_pipeline_streaming()
+            users_count, videos_count = pipeline.stream_totals["users"], pipeline.stream_totals["videos"]
+        else:
+            users_data = pipeline.extract_users_data()
+            durations["extract_users"] = time.perf_counter() - start_time
+
+            step_start = time.perf_counter()
+            videos_data = pipeline.extract_videos_data(users_data)
+            durations["extract_videos"] = time.perf_counter() - step_start
+
+            step_start = time.perf_counter()
+            users, videos = pipeline.transform_data(users_data, videos_data)
+            durations["transform"] = time.perf_counter() - step_start
+
+            step_start = time.perf_counter()
+            pipeline.load_data(users, videos)
+            durations["load"] = time.perf_counter() - step_start
+            users_count, videos_count = len(users), len(videos)
+        durations["total"] = time.perf_counter() - start_time
+        pipeline.close()
+
+    return {
+        "users": users_count,
+        "videos": videos_count,
+        "durations": durations,
+        "latencies": latencies,
+        "upstream_calls": dict(backend.calls),
+        "upstream_errors": dict(backend.errors)
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark for the TikTok ETL pipeline")
+    parser.add_argument("--accounts", type=int, default=200, help="Number of synthetic accounts (default: 200)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help=f"Concurrent account requests (default: {MAX_WORKERS})")
+    parser.add_argument("--sessions", type=int, default=API_SESSION_POOL_SIZE, help=f"Session pool size (default: {API_SESSION_POOL_SIZE})")
+    parser.add_argument("--latency-ms", type=float, default=FAKE_API_LATENCY_MS, help=f"Mean simulated API latency (default: {FAKE_API_LATENCY_MS})")
+    parser.add_argument("--rate-429", type=float, default=FAKE_API_429_RATE, help=f"Share of calls answered with 429 (default: {FAKE_API_429_RATE})")
+    parser.add_argument("--rate-503", type=float, default=FAKE_API_503_RATE, help=f"Share of calls answered with 503 (default: {FAKE_API_503_RATE})")
+    parser.add_argument("--videos-per-account", type=int, default=FAKE_API_VIDEOS_PER_ACCOUNT, help=f"Videos per synthetic account (default: {FAKE_API_VIDEOS_PER_ACCOUNT})")
+    parser.add_argument("--rate-limit", type=float, default=1000.0, help="Initial requests per second per endpoint (default: 1000)")
+    parser.add_argument("--cache", action="store_true", help="Enable the in-memory response cache")
+    parser.add_argument("--load", action="store_true", help="Load into the configured PostgreSQL instead of a null sink")
+    parser.add_argument("--streaming", action="store_true", help="Run the stages concurrently over bounded queues")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    print("Benchmark started with configuration:")
+    print(f"  - Accounts: {args.accounts}, videos per account: {args.videos_per_account}")
+    print(f"  - Workers: {args.workers}, sessions: {args.sessions}")
+    print(f"  - Latency: {args.latency_ms:.0f} ms, 429 rate: {args.rate_429}, 503 rate: {args.rate_503}")
+    print(f"  - Sink: {'postgres' if args.load else 'null'}, mode: {'streaming' if args.streaming else 'sequential'}")
+
+    result = run_benchmark(args)
+    durations = result["durations"]
+
+    print("\nBenchmark completed")
+    print(f"Users: {result['users']:,}, videos: {result['videos']:,}")
+    for step, duration in durations.items():
+        print(f"  {step:<15} {duration:8.2f} s")
+    print(f"Accounts per second: {result['users'] / durations['total']:.2f}")
+    print(f"Videos per second: {result['videos'] / durations['total']:.2f}")
+    print(f"Upstream calls: {result['upstream_calls']}, errors: {result['upstream_errors']}")
+    for endpoint, values in sorted(result["latencies"].items()):
+        print(f"  {endpoint:<12} calls={len(values):<6} p50={percentile(values, 0.5) * 1000:8.1f} ms  p99={percentile(values, 0.99) * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
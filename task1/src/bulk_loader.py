@@ -0,0 +1,120 @@
+import re
+import logging
+from datetime import datetime
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+LOADED_ROWS = Counter('db_loaded_rows_total', 'Rows written by the bulk loader', ['table', 'action'])
+
+USER_COLUMNS = ["id", "username", "display_name", "bio", "follower_count", "following_count"]
+VIDEO_COLUMNS = ["id", "user_id", "caption", "create_time", "like_count", "comment_count", "view_count", "share_count"]
+METRICS_COLUMNS = ["video_id", "hour", "like_count", "comment_count", "view_count", "share_count", "collected_at"]
+
+PARTITION_BOUND = re.compile(r"FOR VALUES FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+def to_rows(records, columns):
+    return [tuple(getattr(record, column) for column in columns) for record in records]
+
+async def bulk_upsert(conn, table, columns, rows, key="id", touch_column=None):
+    if not rows:
+        return {"inserted": 0, "updated": 0}
+
+    staging = f"staging_{table}"
+    column_list = ", ".join(columns)
+    updates = [f"{column} = EXCLUDED.{column}" for column in columns if column != key]
+    if touch_column:
+        updates.append(f"{touch_column} = CURRENT_TIMESTAMP")
+    changed = " OR ".join(f"{table}.{column} IS DISTINCT FROM EXCLUDED.{column}" for column in columns if column != key)
+
+    await conn.execute(f"CREATE TEMP TABLE {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+    await conn.copy_records_to_table(staging, records=rows, columns=columns)
+    # DISTINCT ON keeps one row per key, ON CONFLICT cannot touch the same row twice in one statement
+    results = await conn.fetch(f"""
+        INSERT INTO {table} ({column_list})
+        SELECT DISTINCT ON ({key}) {column_list} FROM {staging} ORDER BY {key}
+        ON CONFLICT ({key}) DO UPDATE SET {", ".join(updates)}
+        WHERE {changed}
+        RETURNING (xmax = 0) AS inserted
+    """)
+    inserted = sum(1 for row in results if row["inserted"])
+    stats = {"inserted": inserted, "updated": len(results) - inserted}
+
+    LOADED_ROWS.labels(table=table, action="inserted").inc(stats["inserted"])
+    LOADED_ROWS.labels(table=table, action="updated").inc(stats["updated"])
+    logger.info(f"Bulk upsert into {table}: {stats['inserted']} inserted, {stats['updated']} updated, "
+                f"{len(rows) - len(results)} unchanged")
+    return stats
+
+async def load_users(conn, users):
+    return await bulk_upsert(conn, "users", USER_COLUMNS, to_rows(users, USER_COLUMNS), touch_column="updated_at")
+
+async def load_videos(conn, videos):
+    return await bulk_upsert(conn, "videos", VIDEO_COLUMNS, to_rows(videos, VIDEO_COLUMNS), touch_column="collected_at")
+
+async def get_range_partitions(conn, table):
+    rows = await conn.fetch("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = $1::text::regclass
+    """, table)
+    partitions = []
+    for name, bound in rows:
+        match = PARTITION_BOUND.match(bound or "")
+        if match:
+            partitions.append((name, datetime.fromisoformat(match.group(1)), datetime.fromisoformat(match.group(2))))
+    return partitions
+
+def find_partition(partitions, value):
+    for name, lower, upper in partitions:
+        if lower <= value < upper:
+            return name
+    return None
+
+def snapshot_hour(collected_at):
+    return collected_at.replace(minute=0, second=0, microsecond=0)
+
+async def load_hourly_metrics(conn, videos, collected_at, table="video_metrics_hourly"):
+    hour = snapshot_hour(collected_at)
+    snapshots = {
+        video.id: (video.id, hour, video.like_count, video.comment_count,
+                   video.view_count, video.share_count, collected_at)
+        for video in videos
+    }
+    if not snapshots:
+        return {"inserted": 0, "skipped": 0}
+
+    staging = f"staging_{table}"
+    column_list = ", ".join(METRICS_COLUMNS)
+    await conn.execute(f"""
+        CREATE TEMP TABLE {staging} (
+            video_id VARCHAR(255),
+            hour TIMESTAMP,
+            like_count BIGINT,
+            comment_count BIGINT,
+            view_count BIGINT,
+            share_count BIGINT,
+            collected_at TIMESTAMP
+        ) ON COMMIT DROP
+    """)
+    await conn.copy_records_to_table(staging, records=list(snapshots.values()), columns=METRICS_COLUMNS)
+
+    # Writing into the leaf partition skips tuple routing, the parent is only a fallback
+    target = find_partition(await get_range_partitions(conn, table), hour)
+    if target is None:
+        logger.warning(f"No partition of {table} covers {hour}, inserting through the parent table")
+        target = table
+    status = await conn.execute(f"""
+        INSERT INTO {target} ({column_list})
+        SELECT {column_list} FROM {staging}
+        ON CONFLICT (video_id, hour) DO NOTHING
+    """)
+    inserted = int(status.split()[-1])
+    stats = {"inserted": inserted, "skipped": len(snapshots) - inserted}
+
+    LOADED_ROWS.labels(table=table, action="inserted").inc(stats["inserted"])
+    LOADED_ROWS.labels(table=table, action="skipped").inc(stats["skipped"])
+    logger.info(f"Hourly snapshot into {target}: {stats['inserted']} inserted, "
+                f"{stats['skipped']} already recorded for {hour}")
+    return stats
@@ -0,0 +1,35 @@
+import asyncio
+
+_EXHAUSTED = object()
+
+async def bounded_as_completed(items, func, limit):
+    items = iter(items)
+    limit = max(1, int(limit))
+    pending = {}
+
+    def fill():
+        while len(pending) < limit:
+            item = next(items, _EXHAUSTED)
+            if item is _EXHAUSTED:
+                return
+            pending[asyncio.ensure_future(func(item))] = item
+
+    fill()
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            finished = []
+            for task in done:
+                item = pending.pop(task)
+                if task.cancelled():
+                    finished.append((item, None, asyncio.CancelledError()))
+                elif task.exception() is not None:
+                    finished.append((item, None, task.exception()))
+                else:
+                    finished.append((item, task.result(), None))
+            fill()
+            for result in finished:
+                yield result
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,93 @@
+import time
+import asyncio
+import logging
+import asyncpg
+from contextlib import asynccontextmanager
+from prometheus_client import Gauge, Histogram
+
+from config.config import (
+    DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD,
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_ACQUIRE_TIMEOUT,
+    DB_POOL_MAX_INACTIVE_LIFETIME, DB_STATEMENT_CACHE_SIZE, DB_COMMAND_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+DB_POOL_WAIT = Histogram('db_pool_acquire_wait_seconds', 'Time spent waiting for a pooled database connection',
+                         buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30))
+DB_POOL_SIZE = Gauge('db_pool_connections', 'Open connections in the database pool')
+DB_POOL_IN_USE = Gauge('db_pool_connections_in_use', 'Database connections currently leased from the pool')
+DB_POOL_UTILIZATION = Gauge('db_pool_utilization', 'Leased connections as a share of the pool max size')
+
+class Database:
+    def __init__(self, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT, statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+                 command_timeout=DB_COMMAND_TIMEOUT, max_inactive_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+                 **connect_kwargs):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.statement_cache_size = statement_cache_size
+        self.command_timeout = command_timeout
+        self.max_inactive_lifetime = max_inactive_lifetime
+        self.connect_kwargs = connect_kwargs or {
+            "host": DB_HOST,
+            "port": DB_PORT,
+            "database": DB_NAME,
+            "user": DB_USER,
+            "password": DB_PASSWORD
+        }
+        self.pool = None
+        self._connect_lock = None
+        self._in_use = 0
+
+    async def connect(self):
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self.pool is None:
+                self.pool = await asyncpg.create_pool(
+                    min_size=self.min_size,
+                    max_size=self.max_size,
+                    statement_cache_size=self.statement_cache_size,
+                    command_timeout=self.command_timeout,
+                    max_inactive_connection_lifetime=self.max_inactive_lifetime,
+                    **self.connect_kwargs
+                )
+                logger.info(f"Database pool opened for {self.connect_kwargs.get('database')} "
+                            f"({self.min_size}-{self.max_size} connections)")
+                self._update_metrics()
+        return self.pool
+
+    def _update_metrics(self):
+        DB_POOL_SIZE.set(self.pool.get_size() if self.pool else 0)
+        DB_POOL_IN_USE.set(self._in_use)
+        DB_POOL_UTILIZATION.set(self._in_use / self.max_size if self.max_size else 0)
+
+    @asynccontextmanager
+    async def acquire(self):
+        pool = self.pool or await self.connect()
+        start_time = time.perf_counter()
+        connection = await pool.acquire(timeout=self.acquire_timeout)
+        DB_POOL_WAIT.observe(time.perf_counter() - start_time)
+        self._in_use += 1
+        self._update_metrics()
+        try:
+            yield connection
+        finally:
+            self._in_use -= 1
+            await pool.release(connection)
+            self._update_metrics()
+
+    @asynccontextmanager
+    async def transaction(self):
+        async with self.acquire() as connection:
+            async with connection.transaction():
+                yield connection
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+            self._update_metrics()
+            logger.info("Database pool closed")
@@ -1,24 +1,22 @@
-import os
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, create_engine
+from functools import lru_cache
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
-from dotenv import load_dotenv
 
-load_dotenv()
-
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_NAME = os.getenv("DB_NAME")
+from config.config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
 
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 Base = declarative_base()
 
+# The pipeline writes through the asyncpg pool in database.py, the engine is only
+# needed for schema creation and ad-hoc ORM sessions, so it is created on first use
+@lru_cache(maxsize=1)
+def get_engine():
+    return create_engine(DATABASE_URL, pool_pre_ping=True)
+
 class User(Base):
     __tablename__ = "users"
     
@@ -41,10 +39,10 @@ class Video(Base):
     user_id = Column(String, ForeignKey("users.id"))
     caption = Column(String)
     create_time = Column(DateTime)
-    like_count = Column(Integer)
-    comment_count = Column(Integer)
-    view_count = Column(Integer)
-    share_count = Column(Integer)
+    like_count = Column(BigInteger)
+    comment_count = Column(BigInteger)
+    view_count = Column(BigInteger)
+    share_count = Column(BigInteger)
     collected_at = Column(DateTime, default=datetime.utcnow)
     
     user = relationship("User", back_populates="videos")
@@ -56,17 +54,17 @@ class VideoMetricsHourly(Base):
     id = Column(Integer, primary_key=True)
     video_id = Column(String, ForeignKey("videos.id"))
     hour = Column(DateTime)
-    like_count = Column(Integer)
-    comment_count = Column(Integer)
-    view_count = Column(Integer)
-    share_count = Column(Integer)
+    like_count = Column(BigInteger)
+    comment_count = Column(BigInteger)
+    view_count = Column(BigInteger)
+    share_count = Column(BigInteger)
     collected_at = Column(DateTime, default=datetime.utcnow)
 
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    Base.metadata.create_all(bind=get_engine())
 
 def get_db():
-    db = SessionLocal()
+    db = SessionLocal(bind=get_engine())
     try:
         return db
     finally:
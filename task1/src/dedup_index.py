@@ -0,0 +1,144 @@
+import math
+import mmap
+import hashlib
+import logging
+from pathlib import Path
+from prometheus_client import Counter, Gauge
+
+from config.config import (
+    DEDUP_INDEX_BACKEND, DEDUP_INDEX_CAPACITY, DEDUP_INDEX_ERROR_RATE
+)
+
+logger = logging.getLogger(__name__)
+
+DEDUP_INDEX_ITEMS = Gauge('dedup_index_items', 'Number of video IDs in the seen-video index')
+DEDUP_INDEX_LOOKUPS = Counter('dedup_index_lookups_total', 'Seen-video index lookups by outcome', ['result'])
+
+class BloomFilter:
+    def __init__(self, path, capacity=DEDUP_INDEX_CAPACITY, error_rate=DEDUP_INDEX_ERROR_RATE):
+        self.path = Path(path)
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.capacity = capacity
+        size = (self.num_bits + 7) // 8
+        self.created = not self.path.exists() or self.path.stat().st_size != size
+        if self.created:
+            with open(self.path, 'wb') as f:
+                f.truncate(size)
+        self._file = open(self.path, 'r+b')
+        self._bits = mmap.mmap(self._file.fileno(), size)
+
+    @property
+    def params(self):
+        return {"bits": self.num_bits, "hashes": self.num_hashes}
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(str(item).encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        added = False
+        for position in self._positions(item):
+            mask = 1 << (position & 7)
+            if not self._bits[position >> 3] & mask:
+                self._bits[position >> 3] |= mask
+                added = True
+        return added
+
+    def __contains__(self, item):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def clear(self):
+        self._bits[:] = bytes(len(self._bits))
+
+    def flush(self):
+        self._bits.flush()
+
+    def close(self):
+        self._bits.close()
+        self._file.close()
+
+class MemorySeenIndex:
+    def __init__(self, store):
+        self._seen = set(store.iter_processed_videos())
+        DEDUP_INDEX_ITEMS.set(len(self._seen))
+
+    def __contains__(self, video_id):
+        found = str(video_id) in self._seen
+        DEDUP_INDEX_LOOKUPS.labels(result="hit" if found else "negative").inc()
+        return found
+
+    def add_many(self, video_ids):
+        self._seen.update(str(video_id) for video_id in video_ids)
+        DEDUP_INDEX_ITEMS.set(len(self._seen))
+
+    def close(self):
+        self._seen.clear()
+
+class StoreSeenIndex:
+    def __init__(self, store):
+        self.store = store
+        DEDUP_INDEX_ITEMS.set(store.count_processed_videos())
+
+    def __contains__(self, video_id):
+        found = self.store.has_processed_video(video_id)
+        DEDUP_INDEX_LOOKUPS.labels(result="hit" if found else "negative").inc()
+        return found
+
+    def add_many(self, video_ids):
+        unique_ids = {str(video_id) for video_id in video_ids}
+        DEDUP_INDEX_ITEMS.inc(sum(1 for video_id in unique_ids if not self.store.has_processed_video(video_id)))
+
+    def close(self):
+        pass
+
+class BloomSeenIndex:
+    def __init__(self, store, path=None, capacity=DEDUP_INDEX_CAPACITY, error_rate=DEDUP_INDEX_ERROR_RATE):
+        self.store = store
+        self.bloom = BloomFilter(path or Path(store.path).with_name("seen_videos.bloom"), capacity, error_rate)
+        self.count = store.count_processed_videos()
+        if self.bloom.created or store.get_run_metadata("dedup_index") != self.bloom.params:
+            self._rebuild()
+        DEDUP_INDEX_ITEMS.set(self.count)
+
+    def _rebuild(self):
+        logger.info(f"Rebuilding seen-video bloom filter from {self.count} stored IDs")
+        self.bloom.clear()
+        for video_id in self.store.iter_processed_videos():
+            self.bloom.add(video_id)
+        self.bloom.flush()
+        with self.store.transaction() as conn:
+            self.store.set_run_metadata(conn, "dedup_index", self.bloom.params)
+
+    def __contains__(self, video_id):
+        if video_id not in self.bloom:
+            DEDUP_INDEX_LOOKUPS.labels(result="negative").inc()
+            return False
+        found = self.store.has_processed_video(video_id)
+        DEDUP_INDEX_LOOKUPS.labels(result="hit" if found else "false_positive").inc()
+        return found
+
+    def add_many(self, video_ids):
+        # Bits are flushed before the exact store commits, so a crash can only leave extra positives
+        added = 0
+        for video_id in {str(video_id) for video_id in video_ids}:
+            # No new bit means a repeat or a false positive, which only the store can tell apart
+            if self.bloom.add(video_id) or not self.store.has_processed_video(video_id):
+                added += 1
+        self.bloom.flush()
+        self.count += added
+        DEDUP_INDEX_ITEMS.set(self.count)
+        if self.count > self.bloom.capacity:
+            logger.warning(f"Seen-video index holds {self.count} IDs, above its capacity of {self.bloom.capacity}")
+
+    def close(self):
+        self.bloom.close()
+
+def create_seen_index(store, backend=DEDUP_INDEX_BACKEND):
+    if backend == "memory":
+        return MemorySeenIndex(store)
+    if backend == "store":
+        return StoreSeenIndex(store)
+    return BloomSeenIndex(store)
@@ -1,20 +1,35 @@
-import logging
+# ruff: noqa: E402
 import time
+
+# Read before the remaining imports so that start-up timing includes them
+STARTED_AT = time.perf_counter()
+
+import asyncio
+import logging
 import argparse
-import schedule
-import json
 from datetime import datetime
+from contextlib import contextmanager
 from prometheus_client import start_http_server, Counter, Gauge, Histogram
 from pathlib import Path
-from sqlalchemy.orm import sessionmaker
 
 from config.config import (
     LOG_DIR, LOG_FILE, LOG_LEVEL, PROMETHEUS_PORT,
-    ETL_SCHEDULE_INTERVAL, get_target_accounts
+    ETL_SCHEDULE_INTERVAL, USER_REFRESH_INTERVAL, MAX_WORKERS, PARTITION_MAINTENANCE_INTERVAL, STREAMING_PIPELINE,
+    STREAM_QUEUE_SIZE, STREAM_BATCH_SIZE, STREAM_TRANSFORM_WORKERS, STREAM_LOAD_WORKERS,
+    ACCOUNT_LEASES_ENABLED, WORKER_ID, KAFKA_PUBLISH_SNAPSHOTS, VIDEO_SNAPSHOT_MAX_AGE, get_target_accounts
 )
+from concurrency import bounded_as_completed
+from stages import Stage, Batcher, run_stages
 from tiktok_api import TikTokAPIClient
-from db_models import User, Video, Base, engine
-from kafka_producer import KafkaProducer
+from state_store import StateStore
+from dedup_index import create_seen_index
+from database import Database
+from records import UserRecord, VideoRecord, to_records
+from bulk_loader import load_users, load_videos, load_hourly_metrics, snapshot_hour
+from rollups import refresh_rollups
+from partition_manager import maintain_partitions
+from account_leases import AccountLeases
+from poll_scheduler import PollScheduler
 
 logging.basicConfig(
     level=getattr(logging, LOG_LEVEL),
@@ -30,6 +45,7 @@ PIPELINE_DURATION = Histogram('pipeline_duration_seconds', 'Time spent processin
 PIPELINE_ERRORS = Counter('pipeline_errors_total', 'Total number of pipeline errors', ['step'])
 PIPELINE_PROGRESS = Gauge('pipeline_progress', 'Current progress of the pipeline', ['step'])
 DATA_VOLUME = Gauge('data_volume', 'Volume of data processed', ['type'])
+STARTUP_DURATION = Gauge('pipeline_startup_seconds', 'Time spent in each startup phase', ['phase'])
 
 def log_pipeline_step(step_name):
     def decorator(func):
@@ -50,44 +66,105 @@ def log_pipeline_step(step_name):
     return decorator
 
 class TikTokETLPipeline:
-    def __init__(self):
-        self.api_client = TikTokAPIClient()
-        self.kafka_producer = KafkaProducer()
-        self.target_accounts = get_target_accounts()
-        self.state_file = Path(LOG_DIR) / "pipeline_state.json"
-        self._load_state()
-        self.setup_database()
-    
-    def setup_database(self):
-        Base.metadata.create_all(engine)
-    
-    def _load_state(self):
+    def __init__(self, max_workers=None, api_client=None, kafka_producer=None, state_store=None, target_accounts=None, database=None, worker_id=None):
+        # Browser sessions, Kafka and the database pool are opened on first use
+        self.startup_timings = {}
+        with self._startup_phase("clients"):
+            self.api_client = api_client or TikTokAPIClient()
+            self._kafka_producer = kafka_producer
+            self.database = database or Database()
+        self.target_accounts = target_accounts or get_target_accounts()
+        self.max_workers = max_workers or MAX_WORKERS
+        self._loop = asyncio.get_event_loop()
+        self.leases = AccountLeases(self.database, worker_id) if worker_id else None
+        self.lease_watermarks = {}
+        self.completed_accounts = {}
+        self.poll_scheduler = None
+        with self._startup_phase("state"):
+            self.state_store = state_store or StateStore()
+            self.state_store.import_json_state(Path(LOG_DIR) / "pipeline_state.json")
+            self.seen_videos = create_seen_index(self.state_store)
+        self._reset_pending_state()
+        self._database_ready = False
+        self._database_lock = asyncio.Lock()
+    
+    @contextmanager
+    def _startup_phase(self, phase):
+        start_time = time.perf_counter()
         try:
-            if self.state_file.exists():
-                with open(self.state_file, 'r') as f:
-                    state = json.load(f)
-                    state["processed_videos"] = set(state.get("processed_videos", []))
-                    self.state = state
-            else:
-                self.state = {
-                    "last_processed": {},
-                    "processed_videos": set(),
-                    "last_user_update": {}
-                }
+            yield
+        finally:
+            self.startup_timings[phase] = time.perf_counter() - start_time
+            STARTUP_DURATION.labels(phase=phase).set(self.startup_timings[phase])
+    
+    def log_startup(self, **timings):
+        timings.update(self.startup_timings)
+        logger.info(f"Startup took {sum(timings.values()):.2f}s: "
+                    + ", ".join(f"{phase}={duration:.2f}s" for phase, duration in timings.items()))
+    
+    @property
+    def kafka_producer(self):
+        if self._kafka_producer is None:
+            with self._startup_phase("kafka"):
+                from kafka_producer import TikTokKafkaProducer
+                self._kafka_producer = TikTokKafkaProducer()
+            logger.info(f"Kafka producer created in {self.startup_timings['kafka']:.2f}s")
+        return self._kafka_producer
+    
+    async def setup_database(self):
+        from db_models import init_db
+        await self._loop.run_in_executor(None, init_db)
+        await self._maintain_partitions()
+    
+    async def _ensure_database(self):
+        # Schema and partitions are set up before the first database use instead of at construction
+        async with self._database_lock:
+            if self._database_ready:
+                return
+            with self._startup_phase("database"):
+                await self.setup_database()
+            self._database_ready = True
+            logger.info(f"Database set up in {self.startup_timings['database']:.2f}s")
+    
+    async def _maintain_partitions(self):
+        try:
+            return await maintain_partitions(self.database)
         except Exception as e:
-            logger.error(f"Error loading state: {e}")
-            self.state = {
-                "last_processed": {},
-                "processed_videos": set(),
-                "last_user_update": {}
-            }
+            PIPELINE_ERRORS.labels(step="partitions").inc()
+            logger.error(f"Partition maintenance failed: {e}")
+    
+    def maintain_partitions(self):
+        return self._loop.run_until_complete(self._maintain_partitions())
     
-    def _save_state(self):
+    def _reset_pending_state(self):
+        self.pending_state = {
+            "last_user_update": {},
+            "video_watermarks": {}
+        }
+    
+    def _pending_state_for(self, usernames):
+        if usernames is None:
+            return self.pending_state
+        return {key: {u: v for u, v in values.items() if u in usernames} for key, values in self.pending_state.items()}
+    
+    def _save_state(self, processed_video_ids=(), run_metadata=None, usernames=None):
         try:
-            state_to_save = self.state.copy()
-            state_to_save["processed_videos"] = list(state_to_save["processed_videos"])
-            with open(self.state_file, 'w') as f:
-                json.dump(state_to_save, f)
+            persisted = self._pending_state_for(usernames)
+            self.seen_videos.add_many(processed_video_ids)
+            with self.state_store.transaction() as conn:
+                self.state_store.update_accounts(conn, **persisted)
+                self.state_store.add_processed_videos(conn, processed_video_ids)
+                for key, value in (run_metadata or {}).items():
+                    self.state_store.set_run_metadata(conn, key, value)
+            if self.leases is not None:
+                for username in set(persisted["last_user_update"]) | set(persisted["video_watermarks"]):
+                    self.completed_accounts[username] = persisted["video_watermarks"].get(username)
+            if usernames is None:
+                self._reset_pending_state()
+            else:
+                for values in self.pending_state.values():
+                    for username in usernames:
+                        values.pop(username, None)
         except Exception as e:
             logger.error(f"Error saving state: {e}")
     
@@ -95,105 +172,325 @@ class TikTokETLPipeline:
         PIPELINE_PROGRESS.labels(step=step).set(progress)
         logger.info(f"Progress for {step}: {progress:.2%}")
     
-    @log_pipeline_step("extract_users")
-    def extract_users_data(self):
-        users_data = []
-        total_accounts = len(self.target_accounts)
-        
-        for i, (username, url) in enumerate(self.target_accounts.items(), 1):
-            try:
-                last_update = self.state["last_user_update"].get(username)
-                if last_update and (datetime.now() - datetime.fromisoformat(last_update)).total_seconds() < 3600:
+    def _is_recently_updated(self, username):
+        last_update = self.state_store.get_last_user_update(username)
+        return bool(last_update) and (datetime.now() - datetime.fromisoformat(last_update)).total_seconds() < USER_REFRESH_INTERVAL
+    
+    async def _fetch_user(self, account):
+        username, url = account
+        user_data = await self.api_client.get_user_info(username, url)
+        if not user_data or not user_data.get("user_info"):
+            raise Exception(f"No user info returned for {username}")
+        user_data["username"] = username
+        return user_data
+    
+    async def stream_users_data(self, accounts=None):
+        if accounts is not None:
+            # Accounts handed out by the lease table or the poll scheduler are already due
+            accounts = list(accounts.items())
+        else:
+            accounts = []
+            for username, url in self.target_accounts.items():
+                if self._is_recently_updated(username):
                     logger.info(f"Skipping recently updated user: {username}")
                     continue
-                    
-                user_data = self.api_client.get_user_info(username, url)
-                if user_data:
-                    users_data.append(user_data)
-                    self.state["last_user_update"][username] = datetime.now().isoformat()
-                    self._update_progress("extract_users", i / total_accounts)
-            except Exception as e:
-                logger.error(f"Error extracting data for user {username}: {e}")
+                accounts.append((username, url))
+        
+        total_accounts = len(accounts)
+        completed = 0
+        async for (username, _), user_data, error in bounded_as_completed(accounts, self._fetch_user, self.max_workers):
+            completed += 1
+            self._update_progress("extract_users", completed / total_accounts)
+            if error:
+                PIPELINE_ERRORS.labels(step="extract_users").inc()
+                logger.error(f"Error extracting data for user {username}: {error}")
+                continue
+            self.pending_state["last_user_update"][username] = datetime.now().isoformat()
+            yield user_data
+    
+    async def _fetch_videos(self, user_data):
+        username = user_data["username"]
+        # Another worker may have advanced the account since this worker last saw it
+        watermark = max(self.state_store.get_video_watermark(username) or 0,
+                        self.lease_watermarks.get(username) or 0) or None
+        user_id = user_data["user_info"].get("id")
+        # The scan goes past the watermark to re-poll recent videos, their counters feed the hourly snapshots.
+        # Older videos are not fetched again and their history stops
+        since = watermark
+        if watermark and VIDEO_SNAPSHOT_MAX_AGE:
+            since = min(watermark, int(time.time()) - VIDEO_SNAPSHOT_MAX_AGE * 86400)
+        videos = []
+        async for page in self.api_client.iter_user_video_pages(username, since=since):
+            for video in page:
+                video["user_id"] = user_id
+            videos.extend(page)
+            watermark = max([watermark or 0] + [v["create_time"] for v in page])
+        if watermark:
+            self.pending_state["video_watermarks"][username] = watermark
+        return videos
+    
+    async def stream_videos_data(self, users_data):
+        total_users = len(users_data)
+        completed = 0
+        async for user_data, user_videos, error in bounded_as_completed(users_data, self._fetch_videos, self.max_workers):
+            completed += 1
+            self._update_progress("extract_videos", completed / total_users)
+            if error:
+                PIPELINE_ERRORS.labels(step="extract_videos").inc()
+                logger.error(f"Error extracting videos for user {user_data['username']}: {error}")
+                continue
+            yield user_videos
+    
+    async def _collect_users(self, accounts=None):
+        return [user_data async for user_data in self.stream_users_data(accounts)]
+    
+    async def _collect_videos(self, users_data):
+        videos_data = []
+        async for user_videos in self.stream_videos_data(users_data):
+            videos_data.extend(user_videos)
+        return videos_data
+    
+    @log_pipeline_step("extract_users")
+    def extract_users_data(self, accounts=None):
+        users_data = self._loop.run_until_complete(self._collect_users(accounts))
         DATA_VOLUME.labels(type="users").set(len(users_data))
         return users_data
     
     @log_pipeline_step("extract_videos")
     def extract_videos_data(self, users_data):
-        videos_data = []
-        total_users = len(users_data)
-        
-        for i, user_data in enumerate(users_data, 1):
-            try:
-                user_videos = self.api_client.get_user_videos(user_data["username"])
-                new_videos = [v for v in user_videos if v["id"] not in self.state["processed_videos"]]
-                videos_data.extend(new_videos)
-                self._update_progress("extract_videos", i / total_users)
-            except Exception as e:
-                logger.error(f"Error extracting videos for user {user_data['username']}: {e}")
+        videos_data = self._loop.run_until_complete(self._collect_videos(users_data))
         DATA_VOLUME.labels(type="videos").set(len(videos_data))
         return videos_data
     
     @log_pipeline_step("transform")
     def transform_data(self, users_data, videos_data):
-        users = [User(**user) for user in users_data]
-        videos = [Video(**video) for video in videos_data]
+        users = to_records(UserRecord, users_data)
+        videos = to_records(VideoRecord, videos_data)
         return users, videos
     
+    async def _write_batch(self, users, videos):
+        await self._ensure_database()
+        collected_at = datetime.utcnow()
+        for video in videos:
+            video.collected_at = collected_at
+        async with self.database.transaction() as conn:
+            user_stats = await load_users(conn, users)
+            video_stats = await load_videos(conn, videos)
+            metrics_stats = await load_hourly_metrics(conn, videos, collected_at)
+            await refresh_rollups(conn, videos, snapshot_hour(collected_at))
+        return user_stats, video_stats, metrics_stats
+    
     @log_pipeline_step("load")
     def load_data(self, users, videos):
-        Session = sessionmaker(bind=engine)
-        session = Session()
-        try:
-            for user in users:
-                session.merge(user)
-            session.commit()
-            for video in videos:
-                if video.id not in self.state["processed_videos"]:
-                    session.merge(video)
-                    self.kafka_producer.send_video(video)
-                    self.state["processed_videos"].add(video.id)
-            session.commit()
-            self._save_state()
-        except Exception:
-            session.rollback()
-            raise
-        finally:
-            session.close()
+        new_videos = [video for video in videos if video.id not in self.seen_videos]
+        user_stats, video_stats, metrics_stats = self._loop.run_until_complete(self._write_batch(users, videos))
+        
+        self.kafka_producer.send_batch(videos if KAFKA_PUBLISH_SNAPSHOTS else new_videos)
+        self.kafka_producer.flush()
+        self._save_state(processed_video_ids=[video.id for video in new_videos])
+        return {"users": user_stats, "videos": video_stats, "video_metrics_hourly": metrics_stats}
+    
+    def _take_completed_accounts(self):
+        completed, self.completed_accounts = self.completed_accounts, {}
+        return completed
+    
+    async def _begin_leases(self):
+        await self._ensure_database()
+        await self.leases.register(self.target_accounts)
+        self.leases.start_heartbeat()
+    
+    async def _end_leases(self):
+        await self.leases.stop_heartbeat()
+        await self.leases.complete(self._take_completed_accounts())
+        await self.leases.release_all()
+    
+    async def _claim_accounts(self):
+        await self.leases.complete(self._take_completed_accounts())
+        rows = await self.leases.claim()
+        self.lease_watermarks.update({row["username"]: row["video_watermark"] for row in rows})
+        return {row["username"]: row["url"] for row in rows}
+    
+    async def _leased_users_data(self):
+        while True:
+            accounts = await self._claim_accounts()
+            if not accounts:
+                return
+            async for user_data in self.stream_users_data(accounts):
+                yield user_data
+    
+    def _process_accounts(self, accounts=None):
+        users_data = self.extract_users_data(accounts)
+        videos_data = self.extract_videos_data(users_data)
+        self.api_client.response_cache.save()
+        users, videos = self.transform_data(users_data, videos_data)
+        self.load_data(users, videos)
+        return len(users), len(videos)
     
     @log_pipeline_step("pipeline")
     def run_pipeline(self):
         try:
-            users_data = self.extract_users_data()
-            videos_data = self.extract_videos_data(users_data)
-            users, videos = self.transform_data(users_data, videos_data)
-            self.load_data(users, videos)
-            self.state["last_processed"] = {
+            if self.leases is None:
+                users_count, videos_count = self._process_accounts()
+            else:
+                users_count = videos_count = 0
+                self._loop.run_until_complete(self._begin_leases())
+                try:
+                    while True:
+                        accounts = self._loop.run_until_complete(self._claim_accounts())
+                        if not accounts:
+                            break
+                        processed = self._process_accounts(accounts)
+                        users_count += processed[0]
+                        videos_count += processed[1]
+                finally:
+                    self._loop.run_until_complete(self._end_leases())
+            self._save_run_metadata(users_count, videos_count)
+        except Exception as e:
+            logger.error(f"Pipeline error: {e}")
+            raise
+    
+    def _save_run_metadata(self, users_count, videos_count):
+        self._save_state(run_metadata={
+            "last_processed": {
                 "timestamp": datetime.now().isoformat(),
-                "users_count": len(users),
-                "videos_count": len(videos)
+                "users_count": users_count,
+                "videos_count": videos_count
             }
-            self._save_state()
+        })
+    
+    async def _stream_extract_videos(self, user_data):
+        return [(user_data, await self._fetch_videos(user_data))]
+    
+    async def _stream_transform(self, item):
+        user_data, videos_data = item
+        users = to_records(UserRecord, [user_data])
+        # An invalid profile invalidates its videos too: they would break the users foreign key and roll back
+        # the whole load batch, and its watermark must not move
+        if not users:
+            return [(None, [], [])]
+        return [(user_data["username"], users, to_records(VideoRecord, videos_data))]
+    
+    async def _stream_load(self, batch):
+        usernames = {username for username, _, _ in batch if username}
+        users = [user for _, user_records, _ in batch for user in user_records]
+        videos = [video for _, _, video_records in batch for video in video_records]
+        await self._write_batch(users, videos)
+        self.stream_totals["users"] += len(users)
+        self.stream_totals["videos"] += len(videos)
+        activity = {username: video_records for username, _, video_records in batch if username}
+        return [(usernames, videos, activity)]
+    
+    async def _stream_publish(self, item):
+        usernames, videos, activity = item
+        new_videos = [video for video in videos if video.id not in self.seen_videos]
+        # The stream processor derives per-window growth from repeated snapshots of a video
+        self.kafka_producer.send_batch(videos if KAFKA_PUBLISH_SNAPSHOTS else new_videos)
+        # Accounts are checkpointed only once their batch is committed
+        self._save_state(processed_video_ids=[video.id for video in new_videos], usernames=usernames)
+        # Leased accounts are polled on the lease cycle, per-account due times would add a second one
+        if self.poll_scheduler is not None and self.leases is None:
+            for username, video_records in activity.items():
+                self.poll_scheduler.observe(username, video_records)
+        return []
+    
+    async def _flush_publish(self):
+        # Delivery reports arrive through callbacks, the stage waits for the broker once at the end
+        await self._loop.run_in_executor(None, self.kafka_producer.flush)
+        return []
+    
+    def _build_stages(self):
+        batcher = Batcher(STREAM_BATCH_SIZE, weight=lambda item: max(1, len(item[2])))
+        return [
+            Stage("extract_videos", self._stream_extract_videos, concurrency=self.max_workers, queue_size=STREAM_QUEUE_SIZE),
+            Stage("transform", self._stream_transform, concurrency=STREAM_TRANSFORM_WORKERS, queue_size=STREAM_QUEUE_SIZE),
+            Stage("batch", batcher.add, queue_size=STREAM_QUEUE_SIZE, flush=batcher.flush),
+            Stage("load", self._stream_load, concurrency=STREAM_LOAD_WORKERS, queue_size=STREAM_LOAD_WORKERS),
+            Stage("publish", self._stream_publish, queue_size=STREAM_QUEUE_SIZE, flush=self._flush_publish)
+        ]
+    
+    async def _stream_accounts(self, accounts=None):
+        self.stream_totals = {"users": 0, "videos": 0}
+        if self.leases is None:
+            await run_stages(self.stream_users_data(accounts), self._build_stages())
+        else:
+            await self._begin_leases()
+            try:
+                await run_stages(self._leased_users_data(), self._build_stages())
+            finally:
+                await self._end_leases()
+        self.api_client.response_cache.save()
+        # Accounts whose batch failed keep their old watermark and are fetched again next run
+        self._reset_pending_state()
+        DATA_VOLUME.labels(type="users").set(self.stream_totals["users"])
+        DATA_VOLUME.labels(type="videos").set(self.stream_totals["videos"])
+        self._save_run_metadata(self.stream_totals["users"], self.stream_totals["videos"])
+    
+    @log_pipeline_step("pipeline_streaming")
+    def run_pipeline_streaming(self):
+        try:
+            self._loop.run_until_complete(self._stream_accounts())
         except Exception as e:
             logger.error(f"Pipeline error: {e}")
             raise
     
+    def run(self, streaming=STREAMING_PIPELINE):
+        if streaming:
+            return self.run_pipeline_streaming()
+        return self.run_pipeline()
+    
+    async def _poll_accounts(self, usernames):
+        logger.info(f"Polling {len(usernames)} due accounts")
+        await self._stream_accounts({username: self.target_accounts[username] for username in usernames})
+    
+    async def _poll_leased_accounts(self):
+        try:
+            await self._stream_accounts()
+        except Exception as e:
+            logger.error(f"Pipeline error: {e}")
+    
     def run_scheduled(self):
-        schedule.every(ETL_SCHEDULE_INTERVAL).minutes.do(self.run_pipeline)
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
+        # Scheduled polls go through the stage runner, which shares the event loop with the scheduler
+        self.poll_scheduler = PollScheduler()
+        self.poll_scheduler.every(PARTITION_MAINTENANCE_INTERVAL * 60, self._maintain_partitions)
+        if self.leases is not None:
+            # Workers sharing accounts follow the lease cycle instead of per-account due times
+            self.poll_scheduler.every(ETL_SCHEDULE_INTERVAL * 60, self._poll_leased_accounts, first_run=time.time())
+        else:
+            for username in self.target_accounts:
+                last_update = self.state_store.get_last_user_update(username)
+                last_polled = datetime.fromisoformat(last_update).timestamp() if last_update else 0
+                self.poll_scheduler.schedule(username, last_polled + self.poll_scheduler.min_interval)
+        self._loop.run_until_complete(self.poll_scheduler.run(self._poll_accounts))
+    
+    def close(self):
+        # Closing the API client also saves the browser state of its sessions for the next start
+        self._loop.run_until_complete(self.api_client.close_api())
+        self._loop.run_until_complete(self.database.close())
+        if self._kafka_producer is not None:
+            self._kafka_producer.close()
+        self.seen_videos.close()
+        self.state_store.close()
 
 def main():
     parser = argparse.ArgumentParser(description="TikTok ETL Pipeline")
     parser.add_argument("--schedule", action="store_true", help="Run on schedule")
+    parser.add_argument("--workers", type=int, default=None, help=f"Concurrent account requests (default: {MAX_WORKERS})")
+    parser.add_argument("--worker-id", default=None, help="Share accounts with other workers through account_leases under this ID")
+    parser.add_argument("--streaming", action="store_true", default=STREAMING_PIPELINE, help="Run extract, transform, load and publish as concurrent stages")
     args = parser.parse_args()
-    pipeline = TikTokETLPipeline()
+    worker_id = args.worker_id or (WORKER_ID if ACCOUNT_LEASES_ENABLED else None)
+    imports_time = time.perf_counter() - STARTED_AT
+    pipeline = TikTokETLPipeline(max_workers=args.workers, worker_id=worker_id)
+    pipeline.log_startup(imports=imports_time)
     start_http_server(PROMETHEUS_PORT)
     
     if args.schedule:
         pipeline.run_scheduled()
     else:
-        pipeline.run_pipeline()
+        try:
+            pipeline.run(streaming=args.streaming)
+        finally:
+            pipeline.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
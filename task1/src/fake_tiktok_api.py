@@ -0,0 +1,134 @@
+import copy
+import json
+import random
+import asyncio
+import zlib
+from pathlib import Path
+from collections import Counter
+
+from config.config import (
+    BASE_DIR, FAKE_API_LATENCY_MS, FAKE_API_LATENCY_JITTER, FAKE_API_429_RATE,
+    FAKE_API_503_RATE, FAKE_API_VIDEOS_PER_ACCOUNT, FAKE_API_SEED, FAKE_API_EPOCH
+)
+
+FIXTURES_DIR = Path(BASE_DIR) / "fixtures"
+
+class FakeApiSettings:
+    def __init__(self, latency_ms=FAKE_API_LATENCY_MS, latency_jitter=FAKE_API_LATENCY_JITTER,
+                 rate_429=FAKE_API_429_RATE, rate_503=FAKE_API_503_RATE,
+                 videos_per_account=FAKE_API_VIDEOS_PER_ACCOUNT, seed=FAKE_API_SEED,
+                 epoch=FAKE_API_EPOCH, fixtures_dir=FIXTURES_DIR):
+        self.latency_ms = latency_ms
+        self.latency_jitter = latency_jitter
+        self.rate_429 = rate_429
+        self.rate_503 = rate_503
+        self.videos_per_account = videos_per_account
+        self.seed = seed
+        self.epoch = epoch
+        self.fixtures_dir = Path(fixtures_dir)
+
+class FakeBackend:
+    def __init__(self, settings=None):
+        self.settings = settings or FakeApiSettings()
+        self._rng = random.Random(self.settings.seed)
+        with open(self.settings.fixtures_dir / "user_info.json", 'r', encoding='utf-8') as f:
+            self.recorded_users = json.load(f)
+        with open(self.settings.fixtures_dir / "user_videos.json", 'r', encoding='utf-8') as f:
+            self.recorded_videos = json.load(f)
+        self._user_template = next(iter(self.recorded_users.values()))
+        self._video_templates = [v for videos in self.recorded_videos.values() for v in videos]
+        self._videos = {}
+        self.calls = Counter()
+        self.errors = Counter()
+
+    async def simulate(self, endpoint):
+        settings = self.settings
+        delay = max(0.0, self._rng.gauss(settings.latency_ms, settings.latency_ms * settings.latency_jitter)) / 1000
+        await asyncio.sleep(delay)
+        roll = self._rng.random()
+        self.calls[endpoint] += 1
+        if roll < settings.rate_429:
+            self.errors["429"] += 1
+            raise Exception("429 Too Many Requests")
+        if roll < settings.rate_429 + settings.rate_503:
+            self.errors["503"] += 1
+            raise Exception("503 Service Unavailable")
+
+    def _account_seed(self, username):
+        return zlib.crc32(username.encode('utf-8')) ^ self.settings.seed
+
+    def user_info(self, username):
+        if username in self.recorded_users:
+            return copy.deepcopy(self.recorded_users[username])
+        rng = random.Random(self._account_seed(username))
+        payload = copy.deepcopy(self._user_template)
+        user = payload["userInfo"]["user"]
+        user["id"] = str(6900000000000000000 + rng.randrange(10 ** 17))
+        user["uniqueId"] = username
+        user["nickname"] = username
+        stats = payload["userInfo"]["stats"]
+        stats["followerCount"] = rng.randrange(1000, 2000000)
+        stats["heartCount"] = stats["followerCount"] * rng.randrange(5, 40)
+        stats["videoCount"] = self.settings.videos_per_account
+        return payload
+
+    def user_videos(self, username):
+        if username in self._videos:
+            return self._videos[username]
+        if username in self.recorded_videos:
+            videos = copy.deepcopy(self.recorded_videos[username])
+        else:
+            rng = random.Random(self._account_seed(username))
+            author = self.user_info(username)["userInfo"]["user"]
+            # Counted back from a fixed epoch, so a seed always yields the same videos
+            create_time = self.settings.epoch - rng.randrange(3600)
+            videos = []
+            for i in range(self.settings.videos_per_account):
+                video = copy.deepcopy(self._video_templates[i % len(self._video_templates)])
+                video["id"] = str(7300000000000000000 + rng.randrange(10 ** 17))
+                video["createTime"] = create_time
+                video["isPinnedItem"] = i == 0
+                video["author"] = {"id": author["id"], "uniqueId": username}
+                views = rng.randrange(1000, 3000000)
+                video["stats"] = {
+                    "diggCount": views // rng.randrange(8, 40),
+                    "commentCount": views // rng.randrange(300, 3000),
+                    "playCount": views,
+                    "shareCount": views // rng.randrange(100, 1000),
+                    "collectCount": views // rng.randrange(50, 500)
+                }
+                videos.append(video)
+                create_time -= rng.randrange(3600, 3 * 86400)
+        # Pinned videos come first, the rest is newest first, as on a real profile
+        videos.sort(key=lambda v: (not v.get("isPinnedItem", False), -int(v["createTime"])))
+        self._videos[username] = videos
+        return videos
+
+class FakeUserApi:
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def info(self, username):
+        await self.backend.simulate("user.info")
+        return self.backend.user_info(username)
+
+    async def videos(self, username, count=30, cursor=0):
+        await self.backend.simulate("user.videos")
+        videos = self.backend.user_videos(username)
+        if cursor:
+            videos = [v for v in videos if int(v["createTime"]) * 1000 < cursor and not v.get("isPinnedItem")]
+        page = copy.deepcopy(videos[:count])
+        next_cursor = int(page[-1]["createTime"]) * 1000 if page else cursor
+        return {"itemList": page, "cursor": next_cursor, "hasMore": len(videos) > count}
+
+class FakeTikTokApi:
+    def __init__(self, backend=None, custom_verify_fp=None):
+        self.backend = backend or FakeBackend()
+        self.user = FakeUserApi(self.backend)
+        self.sessions = []
+
+    async def create_sessions(self, **kwargs):
+        await asyncio.sleep(0)
+
+    async def close_sessions(self):
+        await asyncio.sleep(0)
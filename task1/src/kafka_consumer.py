@@ -1,9 +1,22 @@
 import os
+import re
 import logging
+import pandas as pd
 from pyspark.sql import SparkSession
-from pyspark.sql.functions import from_json, col
-from pyspark.sql.types import StructType, StructField, StringType, IntegerType, TimestampType
+from pyspark.sql.functions import (
+    from_json, col, coalesce, lit, when, window, count, date_trunc, pandas_udf, max as spark_max, min as spark_min
+)
+from pyspark.sql.streaming import StreamingQueryListener
+from pyspark.sql.types import StructType, StructField, StringType, LongType, TimestampType
 from dotenv import load_dotenv
+from prometheus_client import start_http_server, Counter, Gauge
+
+from config.config import (
+    KAFKA_WIRE_FORMAT, SCHEMA_REGISTRY_PATH, SPARK_CHECKPOINT_DIR, SPARK_TRIGGER_INTERVAL, SPARK_METRICS_PORT,
+    SPARK_WINDOWS, SPARK_WATERMARK, SPARK_RAW_SINK
+)
+from stream_sink import PostgresSink, window_sink
+from wire_format import RECORD_SCHEMAS, MsgpackSerializer, SchemaRegistry
 
 load_dotenv()
 
@@ -13,75 +26,163 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+DEDUP_STATE_ROWS = Gauge('stream_dedup_state_rows', 'Event IDs held in the deduplication state', ['query'])
+DEDUP_STATE_BYTES = Gauge('stream_dedup_state_bytes', 'Memory used by the deduplication state', ['query'])
+DEDUP_DROPPED = Counter('stream_dedup_dropped_total', 'Messages dropped by the stream deduplication', ['query', 'reason'])
+
 def create_spark_session():
     return SparkSession.builder \
         .appName("TikTok Streaming") \
         .config("spark.jars.packages", "org.apache.spark:spark-sql-kafka-0-10_2.12:3.4.0") \
+        .config("spark.sql.session.timeZone", "UTC") \
         .getOrCreate()
 
-def process_stream():
-    spark = create_spark_session()
+SPARK_TYPES = {
+    "string": StringType(),
+    "long": LongType(),
+    "timestamp": TimestampType()
+}
+
+def spark_schema(fields):
+    return StructType([StructField(name, SPARK_TYPES[field_type], True) for name, field_type in fields])
+
+def msgpack_decoder(subject, registry_path=SCHEMA_REGISTRY_PATH):
+    fields = RECORD_SCHEMAS[subject]
+    names = [name for name, _ in fields]
     
-    video_schema = StructType([
+    @pandas_udf(spark_schema(fields))
+    def decode(values: pd.Series) -> pd.DataFrame:
+        serializer = MsgpackSerializer(SchemaRegistry(registry_path))
+        rows = []
+        for payload in values:
+            try:
+                message_type, data = serializer.decode(payload)
+            except Exception as e:
+                # A poison message would fail and replay the micro-batch forever, it becomes a null row instead
+                logger.warning(f"Dropping undecodable {subject} message: {e}")
+                rows.append([None] * len(names))
+                continue
+            # Fields are matched by name, so messages written with an older schema ID still decode
+            rows.append([data.get(name) for name in names] if message_type == subject else [None] * len(names))
+        return pd.DataFrame(rows, columns=names, dtype=object)
+    
+    return decode
+
+def parse_videos(kafka_df, wire_format=KAFKA_WIRE_FORMAT):
+    # The Kafka record timestamp goes along as observed_at, replays of a message keep it
+    if wire_format == "msgpack":
+        return kafka_df.select(msgpack_decoder("video_data")(col("value")).alias("video"),
+                               col("timestamp").alias("observed_at")) \
+            .filter(col("video.id").isNotNull()) \
+            .select("video.*", "observed_at")
+    
+    envelope_schema = StructType([
         StructField("type", StringType(), True),
-        StructField("data", StructType([
-            StructField("id", StringType(), True),
-            StructField("user_id", StringType(), True),
-            StructField("caption", StringType(), True),
-            StructField("create_time", TimestampType(), True),
-            StructField("like_count", IntegerType(), True),
-            StructField("comment_count", IntegerType(), True),
-            StructField("view_count", IntegerType(), True),
-            StructField("share_count", IntegerType(), True),
-            StructField("collected_at", TimestampType(), True)
-        ]), True)
+        StructField("data", spark_schema(RECORD_SCHEMAS["video_data"]), True)
     ])
+    return kafka_df.select(from_json(col("value").cast("string"), envelope_schema).alias("parsed_value"),
+                           col("timestamp").alias("observed_at")) \
+        .filter(col("parsed_value.type") == "video_data") \
+        .select("parsed_value.data.*", "observed_at")
+
+def engagement_score():
+    # Same formula as the engagement_score() SQL function
+    weighted = coalesce(col("like_count"), lit(0)) * 2 + coalesce(col("comment_count"), lit(0)) * 3 \
+        + coalesce(col("share_count"), lit(0)) * 5
+    return when(col("view_count") > 0, weighted / col("view_count")).otherwise(lit(0.0))
+
+def parse_windows(spec=SPARK_WINDOWS):
+    windows = []
+    for item in spec.split(","):
+        duration, _, slide = item.partition("/")
+        windows.append((duration.strip(), slide.strip() or duration.strip()))
+    return windows
+
+def deduplicate(video_df, watermark=SPARK_WATERMARK):
+    # The event ID is the video and its snapshot hour, like the key of video_metrics_hourly. Producer retries,
+    # ETL re-runs and extra polls within the hour share it. The watermark sits on the ID column, so old IDs expire
+    return video_df.withColumn("snapshot_hour", date_trunc("hour", col("collected_at"))) \
+        .withWatermark("snapshot_hour", watermark) \
+        .dropDuplicates(["video_id", "snapshot_hour"])
+
+def aggregate_window(video_df, duration, slide):
+    # Counters only grow, so max is the last snapshot and max - min the growth within the window
+    counters = ["like_count", "comment_count", "view_count", "share_count"]
+    gained = {"likes_gained": "like_count", "views_gained": "view_count", "shares_gained": "share_count"}
+    return video_df \
+        .groupBy(window("snapshot_hour", duration, slide), "video_id", "user_id") \
+        .agg(count(lit(1)).alias("snapshots"),
+             *[spark_max(column).alias(column) for column in counters],
+             *[(spark_max(column) - spark_min(column)).alias(name) for name, column in gained.items()]) \
+        .select(col("window.start").alias("window_start"), col("window.end").alias("window_end"),
+                "video_id", "user_id", "snapshots", *counters, *gained) \
+        .withColumn("engagement_score", engagement_score())
+
+class DedupMetricsListener(StreamingQueryListener):
+    def onQueryStarted(self, event):
+        pass
+
+    def onQueryProgress(self, event):
+        progress = event.progress
+        for operator in progress.stateOperators:
+            if operator.operatorName != "dedupe":
+                continue
+            DEDUP_STATE_ROWS.labels(query=progress.name).set(operator.numRowsTotal)
+            DEDUP_STATE_BYTES.labels(query=progress.name).set(operator.memoryUsedBytes)
+            DEDUP_DROPPED.labels(query=progress.name, reason="duplicate").inc(
+                operator.customMetrics.get("numDroppedDuplicateRows", 0))
+            DEDUP_DROPPED.labels(query=progress.name, reason="late").inc(operator.numRowsDroppedByWatermark)
+
+    def onQueryIdle(self, event):
+        pass
+
+    def onQueryTerminated(self, event):
+        pass
+
+def start_query(df, name, sink):
+    # The checkpoint commits offsets after the sink, a failed micro-batch is replayed and upserted again
+    return df.writeStream \
+        .queryName(name) \
+        .outputMode("append") \
+        .foreachBatch(sink) \
+        .option("checkpointLocation", os.path.join(SPARK_CHECKPOINT_DIR, name)) \
+        .trigger(processingTime=SPARK_TRIGGER_INTERVAL) \
+        .start()
+
+def process_stream():
+    spark = create_spark_session()
     
+    # Messages of aborted producer transactions are never read
     kafka_df = spark.readStream \
         .format("kafka") \
         .option("kafka.bootstrap.servers", os.getenv("KAFKA_BOOTSTRAP_SERVERS")) \
         .option("subscribe", os.getenv("KAFKA_TOPIC")) \
         .option("startingOffsets", "latest") \
+        .option("kafka.isolation.level", "read_committed") \
         .load()
     
-    value_df = kafka_df.select(
-        from_json(col("value").cast("string"), video_schema).alias("parsed_value")
-    )
+    # Messages written before collected_at was added fall back to the Kafka timestamp
+    video_df = parse_videos(kafka_df) \
+        .withColumnRenamed("id", "video_id") \
+        .withColumn("collected_at", coalesce(col("collected_at"), col("observed_at")))
+    video_df = deduplicate(video_df)
+    spark.streams.addListener(DedupMetricsListener())
     
-    video_df = value_df.filter(col("parsed_value.type") == "video_data") \
-        .select("parsed_value.data.*")
+    # Append mode emits each window once the watermark passes its end and drops its state
+    for duration, slide in parse_windows():
+        name = re.sub(r"\W+", "_", f"video_engagement_{duration}_{slide}")
+        start_query(aggregate_window(video_df, duration, slide), name, window_sink())
+        logger.info(f"Started window query {name} ({duration} every {slide}, watermark {SPARK_WATERMARK})")
     
-    engagement_df = video_df.withColumn(
-        "engagement_score", 
-        (col("like_count") * 2 + col("comment_count") * 3 + col("share_count") * 5) / col("view_count")
-    )
+    if SPARK_RAW_SINK:
+        start_query(video_df.withColumn("engagement_score", engagement_score()), "video_metrics_realtime", PostgresSink())
     
-    query = engagement_df.writeStream \
-        .outputMode("append") \
-        .format("console") \
-        .start()
-    
-    """
-    query = engagement_df.writeStream \
-        .foreachBatch(lambda df, epoch_id: df.write \
-            .jdbc(
-                url=f"jdbc:postgresql://{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}",
-                table="video_metrics_realtime",
-                mode="append",
-                properties={
-                    "user": os.getenv("DB_USER"),
-                    "password": os.getenv("DB_PASSWORD"),
-                    "driver": "org.postgresql.Driver"
-                }
-            )
-        ) \
-        .start()
-    """
-    query.awaitTermination()
+    spark.streams.awaitAnyTermination()
 
 def main():
     try:
         logger.info("Starting Kafka consumer")
+        start_http_server(SPARK_METRICS_PORT)
         process_stream()
     except Exception as e:
         logger.error(f"Error in Kafka consumer: {e}")
@@ -1,64 +1,143 @@
 import os
-import json
+import time
 import logging
-from datetime import datetime
 from kafka import KafkaProducer
 from dotenv import load_dotenv
+from prometheus_client import Counter, Histogram
+
+from config.config import (
+    KAFKA_ACKS, KAFKA_LINGER_MS, KAFKA_BATCH_SIZE, KAFKA_COMPRESSION_TYPE, KAFKA_FLUSH_TIMEOUT, KAFKA_WIRE_FORMAT,
+    KAFKA_DELIVERY, KAFKA_TRANSACTIONAL_ID, WORKER_ID
+)
+from wire_format import create_serializer
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-class DateTimeEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return super(DateTimeEncoder, self).default(obj)
+KAFKA_MESSAGES = Counter('kafka_messages_total', 'Kafka messages by delivery result', ['type', 'result'])
+KAFKA_DELIVERY_LATENCY = Histogram('kafka_delivery_seconds', 'Time from enqueueing a message to its broker acknowledgement',
+                                   buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+KAFKA_FLUSH_DURATION = Histogram('kafka_flush_seconds', 'Time spent waiting for a flush of the producer buffer')
+KAFKA_TRANSACTIONS = Counter('kafka_transactions_total', 'Producer transactions by outcome', ['result'])
 
 class TikTokKafkaProducer:
-    def __init__(self):
+    def __init__(self, wire_format=KAFKA_WIRE_FORMAT, delivery=KAFKA_DELIVERY):
         self.bootstrap_servers = os.getenv("KAFKA_BOOTSTRAP_SERVERS")
         self.topic = os.getenv("KAFKA_TOPIC")
+        self.serializer = create_serializer(wire_format)
+        self.delivery = delivery
+        self.transactional = delivery == "transactional"
+        self.pending = 0
+        self.failed = 0
         self.producer = self._create_producer()
-        
+
+    def _delivery_options(self):
+        if self.delivery == "at_least_once":
+            return {"enable_idempotence": False}
+        if self.delivery == "idempotent":
+            # Retried batches carry the same sequence number and the broker writes them once
+            return {"enable_idempotence": True}
+        if self.transactional:
+            return {"enable_idempotence": True, "transactional_id": KAFKA_TRANSACTIONAL_ID or f"tiktok-etl-{WORKER_ID}"}
+        raise ValueError(f"Unknown Kafka delivery mode: {self.delivery}")
+
     def _create_producer(self):
         try:
-            return KafkaProducer(
+            producer = KafkaProducer(
                 bootstrap_servers=self.bootstrap_servers,
-                value_serializer=lambda v: json.dumps(v, cls=DateTimeEncoder).encode('utf-8'),
                 key_serializer=lambda k: str(k).encode('utf-8'),
-                acks='all',
-                retries=3
+                acks=KAFKA_ACKS,
+                retries=3,
+                linger_ms=KAFKA_LINGER_MS,
+                batch_size=KAFKA_BATCH_SIZE,
+                compression_type=KAFKA_COMPRESSION_TYPE,
+                **self._delivery_options()
             )
+            if self.transactional:
+                # Fences off a previous producer with the same transactional ID and aborts its open transaction
+                producer.init_transactions()
+            return producer
         except Exception as e:
             logger.error(f"Failed to create Kafka producer: {e}")
             raise
-    
-    def send_user_data(self, username, data):
+
+    def _on_delivered(self, message_type, enqueued_at, metadata):
+        KAFKA_MESSAGES.labels(type=message_type, result="delivered").inc()
+        KAFKA_DELIVERY_LATENCY.observe(time.perf_counter() - enqueued_at)
+
+    def _on_failed(self, message_type, key, error):
+        self.failed += 1
+        KAFKA_MESSAGES.labels(type=message_type, result="failed").inc()
+        logger.error(f"Failed to deliver {message_type} {key} to Kafka: {error}")
+
+    def _send(self, message_type, key, data):
+        # send() only appends to the producer buffer, delivery is reported through the callbacks
         try:
-            future = self.producer.send(
-                self.topic,
-                key=username,
-                value={"type": "user_data", "data": data}
-            )
-            future.get(timeout=10)
-            logger.info(f"Successfully sent user data for {username} to Kafka")
+            future = self.producer.send(self.topic, key=key, value=self.serializer.encode(message_type, data))
+        except Exception as e:
+            self._on_failed(message_type, key, e)
+            return
+        self.pending += 1
+        future.add_callback(self._on_delivered, message_type, time.perf_counter())
+        future.add_errback(self._on_failed, message_type, key)
+
+    def _send_records(self, records):
+        for record in records:
+            key = record.username if record.kind == "user" else record.id
+            self._send(f"{record.kind}_data", key, record.to_dict())
+
+    def send_batch(self, records):
+        if not self.transactional:
+            self._send_records(records)
+            return len(records)
+        if not records:
+            return 0
+
+        # The batch becomes visible to read_committed consumers all at once, or not at all
+        self.failed = 0
+        self.producer.begin_transaction()
+        try:
+            self._send_records(records)
+            if self.failed:
+                raise RuntimeError(f"{self.failed} messages could not be enqueued")
+            start_time = time.perf_counter()
+            self.producer.commit_transaction()
+            KAFKA_FLUSH_DURATION.observe(time.perf_counter() - start_time)
         except Exception as e:
-            logger.error(f"Failed to send user data to Kafka: {e}")
-    
+            logger.error(f"Aborting Kafka transaction of {len(records)} messages: {e}")
+            KAFKA_TRANSACTIONS.labels(result="aborted").inc()
+            self.producer.abort_transaction()
+            raise
+        finally:
+            self.pending = 0
+            self.failed = 0
+        KAFKA_TRANSACTIONS.labels(result="committed").inc()
+        return len(records)
+
+    def send_user_data(self, username, data):
+        self._send("user_data", username, data)
+
     def send_video_data(self, video_id, data):
+        self._send("video_data", video_id, data)
+
+    def flush(self, timeout=KAFKA_FLUSH_TIMEOUT):
+        if not self.pending:
+            return
+        start_time = time.perf_counter()
+        failed_before = self.failed
         try:
-            future = self.producer.send(
-                self.topic,
-                key=video_id,
-                value={"type": "video_data", "data": data}
-            )
-            future.get(timeout=10)
-            logger.info(f"Successfully sent video data for {video_id} to Kafka")
+            self.producer.flush(timeout=timeout)
         except Exception as e:
-            logger.error(f"Failed to send video data to Kafka: {e}")
-    
+            logger.error(f"Kafka flush did not complete: {e}")
+        duration = time.perf_counter() - start_time
+        KAFKA_FLUSH_DURATION.observe(duration)
+        logger.info(f"Flushed {self.pending} messages to Kafka in {duration:.2f}s "
+                    f"({self.failed - failed_before} failed)")
+        self.pending = 0
+
     def close(self):
         if self.producer:
+            self.flush()
             self.producer.close()
-            logger.info("Kafka producer closed") 
\ No newline at end of file
+            logger.info("Kafka producer closed")
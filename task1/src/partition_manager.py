@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import argparse
+from pathlib import Path
+from prometheus_client import Counter
+
+from config.config import (
+    BASE_DIR, PARTITION_PREMAKE, PARTITION_DROP_EXPIRED,
+    VIDEO_METRICS_PARTITION_PERIOD, VIDEO_METRICS_RETENTION
+)
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+PARTITION_CHANGES = Counter('db_partition_changes_total', 'Partitions changed by the partition manager', ['table', 'action'])
+
+MAINTENANCE_SQL = Path(BASE_DIR) / "migrations" / "partition_maintenance.sql"
+
+def get_partition_policies():
+    policy = {
+        "period": VIDEO_METRICS_PARTITION_PERIOD,
+        "premake": PARTITION_PREMAKE,
+        "retention": VIDEO_METRICS_RETENTION,
+        "drop_expired": PARTITION_DROP_EXPIRED
+    }
+    return {
+        "video_metrics_hourly": dict(policy),
+        "video_engagement_hourly": dict(policy),
+        "video_metrics_realtime": dict(policy),
+        "video_engagement_window": dict(policy)
+    }
+
+async def install_functions(conn):
+    with open(MAINTENANCE_SQL, 'r', encoding='utf-8') as f:
+        await conn.execute(f.read())
+
+async def maintain_partitions(database, policies=None):
+    changes = []
+    async with database.transaction() as conn:
+        # Workers sharing the account list start together, CREATE OR REPLACE FUNCTION must not race
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext('partition_maintenance'))")
+        await install_functions(conn)
+        for table, policy in (policies or get_partition_policies()).items():
+            rows = await conn.fetch(
+                "SELECT partition_name, action, row_count FROM maintain_range_partitions("
+                "$1::text::regclass, $2::text::interval, $3, $4::text::interval, $5)",
+                table, policy["period"], policy["premake"], policy["retention"], policy["drop_expired"]
+            )
+            for partition_name, action, row_count in rows:
+                PARTITION_CHANGES.labels(table=table, action=action).inc()
+                logger.info(f"Partition {partition_name} of {table}: {action}"
+                            + (f" ({row_count} rows moved)" if row_count else ""))
+                changes.append({"table": table, "partition": partition_name, "action": action, "rows": row_count})
+
+    if not changes:
+        logger.info("Partitions are up to date")
+    return changes
+
+async def run(policies):
+    database = Database(min_size=1, max_size=1)
+    try:
+        return await maintain_partitions(database, policies)
+    finally:
+        await database.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Create, split and expire partitions of the fact tables")
+    parser.add_argument("--retention", default=VIDEO_METRICS_RETENTION, help=f"Retention window for hourly video tables (default: {VIDEO_METRICS_RETENTION})")
+    parser.add_argument("--drop-expired", action="store_true", default=PARTITION_DROP_EXPIRED, help="Drop expired partitions instead of detaching them")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    policies = get_partition_policies()
+    for policy in policies.values():
+        policy.update(retention=args.retention, drop_expired=args.drop_expired)
+    changes = asyncio.run(run(policies))
+
+    for change in changes:
+        print(f"{change['table']:<22} {change['partition']:<40} {change['action']:<20} {change['rows'] or ''}")
+
+if __name__ == "__main__":
+    main()
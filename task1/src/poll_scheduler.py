@@ -0,0 +1,123 @@
+import time
+import heapq
+import asyncio
+import logging
+from datetime import timezone
+from prometheus_client import Gauge, Histogram
+
+from config.config import POLL_MIN_INTERVAL, POLL_MAX_INTERVAL, POLL_TARGET_VIEWS, POLL_BATCH_WINDOW
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_LAG = Gauge('pipeline_schedule_lag_seconds', 'How long the most overdue account of a poll waited past its due time')
+SCHEDULED_ACCOUNTS = Gauge('pipeline_scheduled_accounts', 'Accounts waiting in the poll schedule')
+POLL_INTERVAL = Histogram('pipeline_poll_interval_seconds', 'Poll intervals chosen from engagement velocity',
+                          buckets=(300, 600, 900, 1800, 3600, 7200, 14400, 21600, 43200, 86400))
+
+def _epoch(value):
+    return value.replace(tzinfo=timezone.utc).timestamp() if value else 0
+
+class PollScheduler:
+    def __init__(self, min_interval=POLL_MIN_INTERVAL, max_interval=POLL_MAX_INTERVAL,
+                 target_views=POLL_TARGET_VIEWS, batch_window=POLL_BATCH_WINDOW, smoothing=0.5):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_views = target_views
+        self.batch_window = batch_window
+        self.smoothing = smoothing
+        self.velocity = {}
+        self.intervals = {}
+        self._snapshots = {}
+        self._due_at = {}
+        self._heap = []
+        self._jobs = []
+
+    def every(self, interval, job, first_run=None):
+        self._jobs.append([first_run or time.time() + interval, interval, job])
+
+    def schedule(self, username, due_at):
+        self._due_at[username] = due_at
+        heapq.heappush(self._heap, (due_at, username))
+        SCHEDULED_ACCOUNTS.set(len(self._due_at))
+
+    def next_due(self):
+        while self._heap:
+            due_at, username = self._heap[0]
+            if self._due_at.get(username) == due_at:
+                return due_at
+            # Stale entry left behind by a reschedule
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now=None):
+        now = time.time() if now is None else now
+        due = []
+        first_due = self.next_due()
+        # Accounts falling due shortly after the first one share its poll instead of starting another
+        while first_due is not None and first_due <= now:
+            due_at, username = heapq.heappop(self._heap)
+            if self._due_at.get(username) == due_at:
+                del self._due_at[username]
+                due.append(username)
+            next_due = self.next_due()
+            if next_due is None or next_due > now + self.batch_window:
+                break
+        if due:
+            SCHEDULE_LAG.set(max(0.0, now - first_due))
+            SCHEDULED_ACCOUNTS.set(len(self._due_at))
+        return due
+
+    def _interval_for(self, velocity):
+        if velocity is None:
+            # Poll again soon to learn how fast the account moves
+            return self.min_interval
+        if velocity <= 0:
+            return self.max_interval
+        return min(self.max_interval, max(self.min_interval, self.target_views / velocity))
+
+    def observe(self, username, videos, polled_at=None):
+        polled_at = time.time() if polled_at is None else polled_at
+        views = {video.id: video.view_count or 0 for video in videos}
+        previous = self._snapshots.get(username)
+        velocity = self.velocity.get(username)
+        if previous is not None:
+            last_polled, last_views = previous
+            growth = 0
+            for video in videos:
+                if video.id in last_views:
+                    growth += max(0, views[video.id] - last_views[video.id])
+                elif _epoch(video.create_time) > last_polled:
+                    # Fresh uploads gained all of their views since the last poll
+                    growth += views[video.id]
+            observed = growth / max(polled_at - last_polled, 1.0)
+            velocity = observed if velocity is None else self.smoothing * observed + (1 - self.smoothing) * velocity
+            self.velocity[username] = velocity
+        self._snapshots[username] = (polled_at, views)
+
+        interval = self._interval_for(velocity)
+        self.intervals[username] = interval
+        POLL_INTERVAL.observe(interval)
+        self.schedule(username, polled_at + interval)
+
+    async def run(self, poll):
+        while True:
+            for entry in self._jobs:
+                if entry[0] <= time.time():
+                    await entry[2]()
+                    entry[0] = time.time() + entry[1]
+
+            accounts = self.pop_due()
+            if accounts:
+                # Polls are awaited one after another, so runs never overlap
+                try:
+                    await poll(accounts)
+                except Exception as e:
+                    logger.error(f"Scheduled poll of {len(accounts)} accounts failed: {e}")
+                for username in accounts:
+                    if username not in self._due_at:
+                        self.schedule(username, time.time() + self.intervals.get(username, self.min_interval))
+                continue
+
+            wake_at = min([due for due in [self.next_due()] if due is not None]
+                          + [entry[0] for entry in self._jobs] + [time.time() + self.max_interval])
+            await asyncio.sleep(max(0.0, wake_at - time.time()))
@@ -0,0 +1,103 @@
+import time
+import asyncio
+import logging
+from prometheus_client import Counter, Gauge
+
+from config.config import (
+    API_RATE_LIMIT, API_RATE_LIMIT_BURST, API_RATE_LIMIT_MIN,
+    API_RATE_LIMIT_MAX, API_RATE_LIMIT_INCREASE, API_RATE_LIMIT_DECREASE,
+    get_endpoint_rate_limits
+)
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_CURRENT = Gauge('api_rate_limit_current', 'Current allowed request rate per second', ['endpoint'])
+RATE_LIMIT_QUEUE_DEPTH = Gauge('api_rate_limit_queue_depth', 'Requests waiting for a rate limit token', ['endpoint'])
+RATE_LIMIT_THROTTLED = Counter('api_rate_limit_throttled_total', 'Total number of throttling responses seen', ['endpoint'])
+
+class AdaptiveTokenBucket:
+    def __init__(self, endpoint, rate, burst=API_RATE_LIMIT_BURST, min_rate=API_RATE_LIMIT_MIN,
+                 max_rate=API_RATE_LIMIT_MAX, increase=API_RATE_LIMIT_INCREASE,
+                 decrease=API_RATE_LIMIT_DECREASE):
+        self.endpoint = endpoint
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.min_rate = float(min_rate)
+        self.max_rate = max(float(max_rate), self.rate)
+        self.increase = float(increase)
+        self.decrease = float(decrease)
+        self.tokens = self.burst
+        self.waiting = 0
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        RATE_LIMIT_CURRENT.labels(endpoint=endpoint).set(self.rate)
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    async def acquire(self):
+        self.waiting += 1
+        RATE_LIMIT_QUEUE_DEPTH.labels(endpoint=self.endpoint).set(self.waiting)
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self.tokens >= 1 and now >= self._paused_until:
+                        self.tokens -= 1
+                        return
+                    wait_time = max((1 - self.tokens) / self.rate, self._paused_until - now)
+                    await asyncio.sleep(wait_time)
+        finally:
+            self.waiting -= 1
+            RATE_LIMIT_QUEUE_DEPTH.labels(endpoint=self.endpoint).set(self.waiting)
+
+    def on_success(self):
+        if self.rate >= self.max_rate:
+            return
+        # Additive increase, spread over roughly one second worth of requests
+        self.rate = min(self.max_rate, self.rate + self.increase / max(self.rate, 1.0))
+        RATE_LIMIT_CURRENT.labels(endpoint=self.endpoint).set(self.rate)
+
+    def on_throttle(self, retry_after=None):
+        RATE_LIMIT_THROTTLED.labels(endpoint=self.endpoint).inc()
+        now = time.monotonic()
+        # Calls that were already in flight report the same 429, only shrink once per interval
+        if now - self._last_decrease >= 1.0 / self.rate:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._last_decrease = now
+            RATE_LIMIT_CURRENT.labels(endpoint=self.endpoint).set(self.rate)
+            logger.warning(f"Rate limit for {self.endpoint} reduced to {self.rate:.2f} req/s")
+        self.tokens = 0.0
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+
+class RateLimiter:
+    def __init__(self, default_rate=API_RATE_LIMIT, endpoint_rates=None):
+        self.default_rate = default_rate
+        self.endpoint_rates = endpoint_rates if endpoint_rates is not None else get_endpoint_rate_limits()
+        self._buckets = {}
+
+    def bucket(self, endpoint):
+        if endpoint not in self._buckets:
+            rate = self.endpoint_rates.get(endpoint, self.default_rate)
+            self._buckets[endpoint] = AdaptiveTokenBucket(endpoint, rate)
+        return self._buckets[endpoint]
+
+    async def acquire(self, endpoint):
+        await self.bucket(endpoint).acquire()
+
+    def on_success(self, endpoint):
+        self.bucket(endpoint).on_success()
+
+    def on_throttle(self, endpoint, retry_after=None):
+        self.bucket(endpoint).on_throttle(retry_after)
+
+    def snapshot(self):
+        return {
+            endpoint: {"rate": bucket.rate, "waiting": bucket.waiting}
+            for endpoint, bucket in self._buckets.items()
+        }
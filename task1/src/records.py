@@ -0,0 +1,118 @@
+import logging
+from datetime import datetime, timezone
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+INVALID_RECORDS = Counter('transform_invalid_records_total', 'API payloads rejected by the transform stage', ['type'])
+
+# Epoch values above this are milliseconds (year 33658 in seconds)
+EPOCH_MS_THRESHOLD = 10 ** 12
+
+def _require_id(value, field):
+    if value is None or str(value).strip() == "":
+        raise ValueError(f"missing {field}")
+    return str(value)
+
+def _to_count(value, field):
+    if value is None or value == "":
+        return None
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} is not a number: {value!r}")
+    if count < 0:
+        raise ValueError(f"{field} is negative: {count}")
+    return count
+
+def to_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    try:
+        epoch = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"create_time is not an epoch timestamp: {value!r}")
+    if epoch <= 0:
+        raise ValueError(f"create_time is not positive: {value!r}")
+    if epoch > EPOCH_MS_THRESHOLD:
+        epoch /= 1000
+    # Naive UTC, like every other timestamp the pipeline writes
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).replace(tzinfo=None)
+
+class UserRecord:
+    __slots__ = ("id", "username", "display_name", "bio", "follower_count", "following_count",
+                 "heart_count", "video_count")
+    kind = "user"
+
+    def __init__(self, id, username, display_name=None, bio=None, follower_count=None,
+                 following_count=None, heart_count=None, video_count=None):
+        self.id = id
+        self.username = username
+        self.display_name = display_name
+        self.bio = bio
+        self.follower_count = follower_count
+        self.following_count = following_count
+        self.heart_count = heart_count
+        self.video_count = video_count
+
+    @classmethod
+    def from_payload(cls, payload):
+        info = payload.get("user_info") or {}
+        return cls(
+            id=_require_id(info.get("id"), "user id"),
+            username=_require_id(payload.get("username"), "username"),
+            display_name=info.get("nickname"),
+            bio=info.get("signature"),
+            follower_count=_to_count(info.get("follower_count"), "follower_count"),
+            following_count=_to_count(info.get("following_count"), "following_count"),
+            heart_count=_to_count(info.get("heart_count"), "heart_count"),
+            video_count=_to_count(info.get("video_count"), "video_count")
+        )
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+class VideoRecord:
+    __slots__ = ("id", "user_id", "caption", "create_time", "like_count", "comment_count",
+                 "view_count", "share_count", "collected_at")
+    kind = "video"
+
+    def __init__(self, id, user_id, caption=None, create_time=None, like_count=None,
+                 comment_count=None, view_count=None, share_count=None, collected_at=None):
+        self.id = id
+        self.user_id = user_id
+        self.caption = caption
+        self.create_time = create_time
+        self.like_count = like_count
+        self.comment_count = comment_count
+        self.view_count = view_count
+        self.share_count = share_count
+        # Set by the load stage to the time of the hourly snapshot
+        self.collected_at = collected_at
+
+    @classmethod
+    def from_payload(cls, payload):
+        statistics = payload.get("statistics") or {}
+        return cls(
+            id=_require_id(payload.get("id"), "video id"),
+            user_id=_require_id(payload.get("user_id"), "user_id"),
+            caption=payload.get("desc"),
+            create_time=to_datetime(payload.get("create_time")),
+            like_count=_to_count(statistics.get("like_count"), "like_count"),
+            comment_count=_to_count(statistics.get("comment_count"), "comment_count"),
+            view_count=_to_count(statistics.get("view_count"), "view_count"),
+            share_count=_to_count(statistics.get("share_count"), "share_count")
+        )
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+def to_records(record_type, payloads):
+    records = []
+    for payload in payloads:
+        try:
+            records.append(record_type.from_payload(payload))
+        except (ValueError, AttributeError) as e:
+            INVALID_RECORDS.labels(type=record_type.kind).inc()
+            logger.warning(f"Skipping invalid {record_type.kind} payload: {e}")
+    return records
@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import logging
+from pathlib import Path
+from collections import OrderedDict
+from prometheus_client import Counter, Gauge
+
+from config.config import (
+    CACHE_DIR, API_RESPONSE_CACHE_TTL, API_RESPONSE_CACHE_MAX_BYTES,
+    API_RESPONSE_CACHE_PERSIST, API_RESPONSE_CACHE_FLUSH_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+CACHE_HITS = Counter('api_response_cache_hits_total', 'Total number of API response cache hits', ['endpoint'])
+CACHE_MISSES = Counter('api_response_cache_misses_total', 'Total number of API response cache misses', ['endpoint'])
+CACHE_ENTRIES = Gauge('api_response_cache_entries', 'Number of cached API responses')
+CACHE_BYTES = Gauge('api_response_cache_bytes', 'Approximate size of cached API responses in bytes')
+
+class ResponseCache:
+    def __init__(self, ttl=API_RESPONSE_CACHE_TTL, max_bytes=API_RESPONSE_CACHE_MAX_BYTES,
+                 path=None, flush_interval=API_RESPONSE_CACHE_FLUSH_INTERVAL):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.path = Path(path) if path else None
+        self.flush_interval = flush_interval
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._dirty = False
+        self._last_flush = time.time()
+        if self.path:
+            self.load()
+
+    @classmethod
+    def from_config(cls):
+        path = Path(CACHE_DIR) / "api_responses.json" if API_RESPONSE_CACHE_PERSIST else None
+        return cls(path=path)
+
+    @staticmethod
+    def make_key(endpoint, username, cursor=None, *extra):
+        return ":".join(str(part) for part in (endpoint, username, cursor or 0, *extra))
+
+    def get(self, endpoint, username, cursor=None, *extra):
+        key = self.make_key(endpoint, username, cursor, *extra)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.time():
+            if entry is not None:
+                self._remove(key)
+            CACHE_MISSES.labels(endpoint=endpoint).inc()
+            return None
+        self._entries.move_to_end(key)
+        CACHE_HITS.labels(endpoint=endpoint).inc()
+        return json.loads(entry[1])
+
+    def set(self, endpoint, username, value, cursor=None, *extra):
+        key = self.make_key(endpoint, username, cursor, *extra)
+        payload = json.dumps(value)
+        if len(payload) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.time() + self.ttl, payload)
+        self._bytes += len(payload)
+        self._evict()
+        self._dirty = True
+        self._update_metrics()
+        if self.path and time.time() - self._last_flush >= self.flush_interval:
+            self.save()
+
+    def _remove(self, key):
+        _, payload = self._entries.pop(key)
+        self._bytes -= len(payload)
+
+    def _evict(self):
+        now = time.time()
+        # Only the least recently used end is checked, get() drops expired entries further back
+        while self._entries:
+            key, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at >= now and self._bytes <= self.max_bytes:
+                break
+            self._remove(key)
+
+    def _update_metrics(self):
+        CACHE_ENTRIES.set(len(self._entries))
+        CACHE_BYTES.set(self._bytes)
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+        self._dirty = True
+        self._update_metrics()
+
+    def load(self):
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+            now = time.time()
+            for key, expires_at, payload in entries:
+                if expires_at >= now:
+                    self._entries[key] = (expires_at, payload)
+                    self._bytes += len(payload)
+            self._evict()
+            self._update_metrics()
+            logger.info(f"Loaded {len(self._entries)} cached API responses from {self.path}")
+        except Exception as e:
+            logger.error(f"Error loading response cache: {e}")
+
+    def save(self):
+        if not self.path or not self._dirty:
+            return
+        try:
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, 'w') as f:
+                now = time.time()
+                json.dump([[key, expires_at, payload] for key, (expires_at, payload) in self._entries.items()
+                           if expires_at >= now], f)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+            self._last_flush = time.time()
+        except Exception as e:
+            logger.error(f"Error saving response cache: {e}")
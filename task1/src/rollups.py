@@ -0,0 +1,121 @@
+import logging
+from datetime import timedelta
+
+from bulk_loader import LOADED_ROWS
+
+logger = logging.getLogger(__name__)
+
+COUNTER_COLUMNS = ["like_count", "comment_count", "view_count", "share_count", "likes_gained", "views_gained"]
+WINDOW_COUNTERS = COUNTER_COLUMNS + ["shares_gained"]
+
+async def refresh_video_hourly(conn, video_ids, hour):
+    # Growth is measured against the closest earlier snapshot, which may be more than an hour old
+    status = await conn.execute("""
+        INSERT INTO video_engagement_hourly (
+            video_id, hour, user_id, like_count, comment_count, view_count, share_count,
+            likes_gained, views_gained, engagement_score, updated_at
+        )
+        SELECT m.video_id, m.hour, v.user_id, m.like_count, m.comment_count, m.view_count, m.share_count,
+               m.like_count - prev.like_count, m.view_count - prev.view_count,
+               engagement_score(m.like_count, m.comment_count, m.share_count, m.view_count),
+               CURRENT_TIMESTAMP
+        FROM video_metrics_hourly m
+        JOIN videos v ON v.id = m.video_id
+        LEFT JOIN LATERAL (
+            SELECT p.like_count, p.view_count
+            FROM video_metrics_hourly p
+            WHERE p.video_id = m.video_id AND p.hour < m.hour
+            ORDER BY p.hour DESC
+            LIMIT 1
+        ) prev ON TRUE
+        WHERE m.video_id = ANY($1::text[]) AND m.hour = $2
+        ON CONFLICT (video_id, hour) DO UPDATE SET
+            like_count = EXCLUDED.like_count,
+            comment_count = EXCLUDED.comment_count,
+            view_count = EXCLUDED.view_count,
+            share_count = EXCLUDED.share_count,
+            likes_gained = EXCLUDED.likes_gained,
+            views_gained = EXCLUDED.views_gained,
+            engagement_score = EXCLUDED.engagement_score,
+            updated_at = EXCLUDED.updated_at
+    """, list(video_ids), hour)
+    return int(status.split()[-1])
+
+async def refresh_user_rollup(conn, table, period_column, user_ids, period_start, period_end):
+    counters = ", ".join(COUNTER_COLUMNS)
+    latest = ", ".join(f"sum({column}) FILTER (WHERE is_latest)" for column in COUNTER_COLUMNS[:4])
+    status = await conn.execute(f"""
+        INSERT INTO {table} (
+            user_id, {period_column}, video_count, {counters}, engagement_score, updated_at
+        )
+        SELECT user_id, $2::timestamp::date, count(*) FILTER (WHERE is_latest), {latest},
+               coalesce(sum(likes_gained), 0), coalesce(sum(views_gained), 0),
+               engagement_score((sum(like_count) FILTER (WHERE is_latest))::bigint,
+                                (sum(comment_count) FILTER (WHERE is_latest))::bigint,
+                                (sum(share_count) FILTER (WHERE is_latest))::bigint,
+                                (sum(view_count) FILTER (WHERE is_latest))::bigint),
+               CURRENT_TIMESTAMP
+        FROM (
+            SELECT user_id, {counters},
+                   row_number() OVER (PARTITION BY video_id ORDER BY hour DESC) = 1 AS is_latest
+            FROM video_engagement_hourly
+            WHERE user_id = ANY($1::text[]) AND hour >= $2::timestamp AND hour < $3::timestamp
+        ) period_rows
+        GROUP BY user_id
+        ON CONFLICT (user_id, {period_column}) DO UPDATE SET
+            video_count = EXCLUDED.video_count,
+            {", ".join(f"{column} = EXCLUDED.{column}" for column in COUNTER_COLUMNS)},
+            engagement_score = EXCLUDED.engagement_score,
+            updated_at = EXCLUDED.updated_at
+    """, list(user_ids), period_start, period_end)
+    return int(status.split()[-1])
+
+async def refresh_user_windows(conn, windows):
+    if not windows:
+        return 0
+
+    # Recomputed from the stored video windows, so a replayed micro-batch produces the same rows
+    counters = WINDOW_COUNTERS
+    user_ids, starts, ends = zip(*windows)
+    status = await conn.execute(f"""
+        INSERT INTO user_engagement_window (
+            user_id, window_start, window_end, video_count, {", ".join(counters)}, engagement_score, updated_at
+        )
+        SELECT w.user_id, w.window_start, w.window_end, count(*),
+               {", ".join(f"sum(w.{column})" for column in counters)},
+               engagement_score(sum(w.like_count)::bigint, sum(w.comment_count)::bigint,
+                                sum(w.share_count)::bigint, sum(w.view_count)::bigint),
+               CURRENT_TIMESTAMP
+        FROM video_engagement_window w
+        JOIN unnest($1::text[], $2::timestamp[], $3::timestamp[]) AS k(user_id, window_start, window_end)
+          ON w.user_id = k.user_id AND w.window_start = k.window_start AND w.window_end = k.window_end
+        GROUP BY w.user_id, w.window_start, w.window_end
+        ON CONFLICT (user_id, window_start, window_end) DO UPDATE SET
+            video_count = EXCLUDED.video_count,
+            {", ".join(f"{column} = EXCLUDED.{column}" for column in counters)},
+            engagement_score = EXCLUDED.engagement_score,
+            updated_at = EXCLUDED.updated_at
+    """, list(user_ids), list(starts), list(ends))
+    return int(status.split()[-1])
+
+async def refresh_rollups(conn, videos, hour):
+    video_ids = {video.id for video in videos}
+    user_ids = {video.user_id for video in videos}
+    if not video_ids:
+        return {}
+
+    day = hour.replace(hour=0)
+    week = day - timedelta(days=day.weekday())
+    stats = {
+        "video_engagement_hourly": await refresh_video_hourly(conn, video_ids, hour),
+        "user_engagement_daily": await refresh_user_rollup(
+            conn, "user_engagement_daily", "day", user_ids, day, day + timedelta(days=1)),
+        "user_engagement_weekly": await refresh_user_rollup(
+            conn, "user_engagement_weekly", "week", user_ids, week, week + timedelta(weeks=1))
+    }
+
+    for table, rows in stats.items():
+        LOADED_ROWS.labels(table=table, action="refreshed").inc(rows)
+    logger.info(f"Refreshed engagement rollups for {len(video_ids)} videos and {len(user_ids)} users: "
+                + ", ".join(f"{table}={rows}" for table, rows in stats.items()))
+    return stats
@@ -0,0 +1,264 @@
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from prometheus_client import Counter, Gauge
+
+from config.config import (
+    CACHE_DIR, TIKTOK_API_BACKEND, API_SESSION_POOL_SIZE, API_SESSION_SLOW_THRESHOLD,
+    API_SESSION_MAX_ERRORS, API_SESSION_LEASE_TIMEOUT, API_SESSION_PERSIST_STATE,
+    API_SESSION_RESTART_DELAY, API_SESSION_RESTART_MAX_DELAY
+)
+
+logger = logging.getLogger(__name__)
+
+SESSION_POOL_HEALTHY = Gauge('api_session_pool_healthy', 'Number of healthy TikTokApi sessions')
+SESSION_IN_FLIGHT = Gauge('api_session_in_flight', 'Requests in flight per TikTokApi session', ['session'])
+SESSION_RECYCLED = Counter('api_session_recycled_total', 'Total number of recycled TikTokApi sessions', ['reason'])
+SESSION_STARTS = Counter('api_session_starts_total', 'TikTokApi session starts by browser state', ['state'])
+
+SESSION_STATE_DIR = CACHE_DIR / "sessions" if API_SESSION_PERSIST_STATE else None
+
+def is_auth_error(error):
+    message = str(error).lower()
+    return "401" in message or "unauthorized" in message
+
+def is_throttle_error(error):
+    message = str(error).lower()
+    return "429" in message or "too many requests" in message or "503" in message
+
+def create_api(tokens, backend=TIKTOK_API_BACKEND):
+    if backend == "fake":
+        from fake_tiktok_api import FakeTikTokApi
+        return FakeTikTokApi(custom_verify_fp=tokens.get("verify_fp"))
+    from TikTokApi import TikTokApi
+    return TikTokApi(custom_verify_fp=tokens.get("verify_fp"))
+
+class PooledSession:
+    def __init__(self, index, tokens, api_factory=create_api, state_path=None):
+        self.index = index
+        self.tokens = tokens
+        self.api_factory = api_factory
+        self.state_path = state_path
+        self.api = None
+        self.in_flight = 0
+        self.healthy = False
+        self.recycling = False
+        self.errors = 0
+        self.latency = None
+
+    @property
+    def name(self):
+        return f"session-{self.index}"
+
+    async def start(self, restore=True, **session_options):
+        if restore and self.state_path and self.state_path.exists():
+            try:
+                await self._create(context_options={"storage_state": str(self.state_path)}, **session_options)
+                SESSION_STARTS.labels(state="restored").inc()
+                return
+            except Exception as e:
+                # A stale or corrupt browser state must not keep the session down
+                logger.warning(f"Could not restore {self.name} from {self.state_path}, starting cold: {e}")
+                self.discard_state()
+        await self._create(**session_options)
+        SESSION_STARTS.labels(state="cold").inc()
+        await self.save_state()
+
+    async def _create(self, **session_options):
+        ms_token = self.tokens.get("ms_token")
+        session_id = self.tokens.get("session_id")
+        api = self.api_factory(self.tokens)
+        await api.create_sessions(
+            ms_tokens=[ms_token] if ms_token else None,
+            session_ids=[session_id] if session_id else None,
+            num_sessions=1,
+            headless=True,
+            **session_options
+        )
+        self.api = api
+        self.errors = 0
+        self.latency = None
+        self.healthy = True
+
+    async def save_state(self):
+        sessions = getattr(self.api, "sessions", None)
+        if not self.state_path or not sessions:
+            return
+        try:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            await sessions[0].context.storage_state(path=str(self.state_path))
+        except Exception as e:
+            logger.warning(f"Could not save browser state of {self.name}: {e}")
+
+    def discard_state(self):
+        if self.state_path:
+            self.state_path.unlink(missing_ok=True)
+
+    async def close(self):
+        self.healthy = False
+        if self.api:
+            await self.save_state()
+            try:
+                await self.api.close_sessions()
+            except Exception as e:
+                logger.error(f"Error closing {self.name}: {e}")
+            self.api = None
+
+class SessionPool:
+    def __init__(self, token_provider, size=API_SESSION_POOL_SIZE, slow_threshold=API_SESSION_SLOW_THRESHOLD,
+                 max_errors=API_SESSION_MAX_ERRORS, lease_timeout=API_SESSION_LEASE_TIMEOUT, api_factory=create_api,
+                 state_dir=SESSION_STATE_DIR, restart_delay=API_SESSION_RESTART_DELAY,
+                 restart_max_delay=API_SESSION_RESTART_MAX_DELAY):
+        self.token_provider = token_provider
+        self.api_factory = api_factory
+        self.state_dir = state_dir
+        self.size = max(1, size)
+        self.slow_threshold = slow_threshold
+        self.max_errors = max_errors
+        self.lease_timeout = lease_timeout
+        self.restart_delay = restart_delay
+        self.restart_max_delay = restart_max_delay
+        self.sessions = []
+        self._changed = asyncio.Condition()
+        self._background = set()
+
+    @property
+    def healthy_count(self):
+        return sum(1 for session in self.sessions if session.healthy)
+
+    async def start(self):
+        self.sessions = [
+            PooledSession(i, self.token_provider(i), self.api_factory,
+                          self.state_dir / f"session-{i}.json" if self.state_dir else None)
+            for i in range(self.size)
+        ]
+        start_time = time.perf_counter()
+        results = await asyncio.gather(*(self._start_session(s) for s in self.sessions))
+        logger.info(f"Started {sum(results)}/{self.size} TikTokApi sessions in {time.perf_counter() - start_time:.2f}s")
+        return any(results)
+
+    async def _start_session(self, session):
+        try:
+            await session.start()
+            return True
+        except Exception as e:
+            logger.error(f"Failed to start {session.name}: {e}")
+            return False
+        finally:
+            await self._notify()
+
+    async def _notify(self):
+        SESSION_POOL_HEALTHY.set(self.healthy_count)
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _acquire(self):
+        async with self._changed:
+            await asyncio.wait_for(
+                self._changed.wait_for(lambda: self.healthy_count > 0),
+                timeout=self.lease_timeout
+            )
+            session = min((s for s in self.sessions if s.healthy), key=lambda s: s.in_flight)
+            session.in_flight += 1
+            SESSION_IN_FLIGHT.labels(session=session.name).set(session.in_flight)
+            return session
+
+    @asynccontextmanager
+    async def lease(self):
+        try:
+            session = await self._acquire()
+        except asyncio.TimeoutError:
+            raise Exception("No healthy TikTokApi session available")
+        start_time = time.monotonic()
+        try:
+            yield session.api
+        except Exception as e:
+            self._on_failure(session, e)
+            raise
+        else:
+            self._on_success(session, time.monotonic() - start_time)
+        finally:
+            session.in_flight -= 1
+            SESSION_IN_FLIGHT.labels(session=session.name).set(session.in_flight)
+
+    def _on_success(self, session, duration):
+        session.errors = 0
+        session.latency = duration if session.latency is None else 0.8 * session.latency + 0.2 * duration
+        if session.latency > self.slow_threshold:
+            self.recycle(session, "slow")
+
+    def _on_failure(self, session, error):
+        if is_auth_error(error):
+            self.recycle(session, "auth")
+        elif not is_throttle_error(error):
+            session.errors += 1
+            if session.errors >= self.max_errors:
+                self.recycle(session, "errors")
+
+    def recycle(self, session, reason):
+        if session.recycling:
+            return
+        session.recycling = True
+        session.healthy = False
+        SESSION_POOL_HEALTHY.set(self.healthy_count)
+        SESSION_RECYCLED.labels(reason=reason).inc()
+        logger.warning(f"Recycling {session.name} ({reason})")
+        task = asyncio.ensure_future(self._recycle(session, reason))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _recycle(self, session, reason):
+        try:
+            while session.in_flight > 0:
+                await asyncio.sleep(0.1)
+            await session.close()
+            if reason == "auth":
+                # Rejected cookies would only be restored again
+                session.discard_state()
+            # A session left down would shrink the pool for good, so the restart is retried until it is up
+            attempt = 0
+            while True:
+                session.tokens = self.token_provider(session.index)
+                if await self._start_session(session):
+                    return
+                delay = min(self.restart_max_delay, self.restart_delay * 2 ** attempt)
+                logger.warning(f"Restart of {session.name} failed, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+        finally:
+            session.recycling = False
+
+    async def rotate_tokens(self):
+        # Sessions are swapped one at a time and only after their replacement is up, so capacity never drops
+        for session in list(self.sessions):
+            if session.recycling or session not in self.sessions:
+                continue
+            fresh = PooledSession(session.index, self.token_provider(session.index), self.api_factory, session.state_path)
+            try:
+                # Restoring the saved cookies would bring back the session the new tokens replace
+                await fresh.start(restore=False)
+            except Exception as e:
+                logger.error(f"Failed to start {fresh.name} with refreshed tokens, keeping the old session: {e}")
+                continue
+            self.sessions[self.sessions.index(session)] = fresh
+            SESSION_RECYCLED.labels(reason="tokens").inc()
+            await self._notify()
+            task = asyncio.ensure_future(self._retire(session))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    async def _retire(self, session):
+        session.healthy = False
+        # The replacement already owns the browser state file
+        session.state_path = None
+        while session.in_flight > 0:
+            await asyncio.sleep(0.1)
+        await session.close()
+
+    async def close(self):
+        for task in list(self._background):
+            task.cancel()
+        await asyncio.gather(*(session.close() for session in self.sessions))
+        self.sessions = []
+        SESSION_POOL_HEALTHY.set(0)
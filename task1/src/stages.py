@@ -0,0 +1,102 @@
+import time
+import asyncio
+import logging
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+STAGE_QUEUE_DEPTH = Gauge('pipeline_stage_queue_depth', 'Items waiting in the queue in front of a stage', ['stage'])
+STAGE_BUSY_WORKERS = Gauge('pipeline_stage_busy_workers', 'Stage workers currently handling an item', ['stage'])
+STAGE_ITEMS = Counter('pipeline_stage_items_total', 'Items handled by a stage', ['stage', 'result'])
+STAGE_DURATION = Histogram('pipeline_stage_item_seconds', 'Time a stage spends on one item', ['stage'])
+
+_DONE = object()
+
+class Stage:
+    def __init__(self, name, handler, concurrency=1, queue_size=100, flush=None):
+        self.name = name
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self.queue_size = queue_size
+        self.flush = flush
+
+class Batcher:
+    def __init__(self, size, weight=None):
+        self.size = size
+        self.weight = weight or (lambda item: 1)
+        self._items = []
+        self._filled = 0
+
+    async def add(self, item):
+        self._items.append(item)
+        self._filled += self.weight(item)
+        if self._filled >= self.size:
+            return await self.flush()
+        return []
+
+    async def flush(self):
+        if not self._items:
+            return []
+        batch, self._items, self._filled = self._items, [], 0
+        return [batch]
+
+async def _put(queue, stage, item):
+    await queue.put(item)
+    STAGE_QUEUE_DEPTH.labels(stage=stage.name).set(queue.qsize())
+
+async def _run_stage(stage, queue, next_stage, next_queue):
+    async def worker():
+        while True:
+            item = await queue.get()
+            STAGE_QUEUE_DEPTH.labels(stage=stage.name).set(queue.qsize())
+            if item is _DONE:
+                return
+            STAGE_BUSY_WORKERS.labels(stage=stage.name).inc()
+            start_time = time.perf_counter()
+            try:
+                outputs = await stage.handler(item)
+                STAGE_ITEMS.labels(stage=stage.name, result="ok").inc()
+            except Exception as e:
+                # One bad item must not stop the run, its state is simply not persisted
+                STAGE_ITEMS.labels(stage=stage.name, result="error").inc()
+                logger.error(f"Error in stage {stage.name}: {e}")
+                outputs = []
+            finally:
+                STAGE_BUSY_WORKERS.labels(stage=stage.name).dec()
+                STAGE_DURATION.labels(stage=stage.name).observe(time.perf_counter() - start_time)
+            if next_queue is not None:
+                for output in outputs or ():
+                    await _put(next_queue, next_stage, output)
+
+    await asyncio.gather(*(worker() for _ in range(stage.concurrency)))
+    if stage.flush is not None:
+        outputs = await stage.flush()
+        if next_queue is not None:
+            for output in outputs:
+                await _put(next_queue, next_stage, output)
+    if next_queue is not None:
+        for _ in range(next_stage.concurrency):
+            await next_queue.put(_DONE)
+
+async def run_stages(source, stages):
+    queues = [asyncio.Queue(maxsize=stage.queue_size) for stage in stages]
+
+    async def feed():
+        try:
+            async for item in source:
+                await _put(queues[0], stages[0], item)
+        finally:
+            for _ in range(stages[0].concurrency):
+                await queues[0].put(_DONE)
+
+    tasks = [asyncio.ensure_future(feed())]
+    for i, stage in enumerate(stages):
+        last = i == len(stages) - 1
+        tasks.append(asyncio.ensure_future(_run_stage(
+            stage, queues[i], None if last else stages[i + 1], None if last else queues[i + 1]
+        )))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,134 @@
+import json
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+from config.config import STATE_DIR
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS account_state (
+    username TEXT PRIMARY KEY,
+    last_user_update TEXT,
+    video_watermark INTEGER
+);
+CREATE TABLE IF NOT EXISTS run_metadata (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS processed_videos (
+    video_id TEXT PRIMARY KEY
+) WITHOUT ROWID;
+"""
+
+class StateStore:
+    def __init__(self, path=None):
+        self.path = Path(path) if path else Path(STATE_DIR) / "pipeline_state.db"
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.path), isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _fetchone(self, query, params=()):
+        with self._lock:
+            return self._conn.execute(query, params).fetchone()
+
+    def get_last_user_update(self, username):
+        row = self._fetchone("SELECT last_user_update FROM account_state WHERE username = ?", (username,))
+        return row[0] if row else None
+
+    def get_video_watermark(self, username):
+        row = self._fetchone("SELECT video_watermark FROM account_state WHERE username = ?", (username,))
+        return row[0] if row else None
+
+    def update_accounts(self, conn, last_user_update=None, video_watermarks=None):
+        conn.executemany(
+            "INSERT INTO account_state (username, last_user_update) VALUES (?, ?) "
+            "ON CONFLICT(username) DO UPDATE SET last_user_update = excluded.last_user_update",
+            (last_user_update or {}).items()
+        )
+        conn.executemany(
+            "INSERT INTO account_state (username, video_watermark) VALUES (?, ?) "
+            "ON CONFLICT(username) DO UPDATE SET video_watermark = "
+            "MAX(COALESCE(video_watermark, 0), excluded.video_watermark)",
+            (video_watermarks or {}).items()
+        )
+
+    def has_processed_video(self, video_id):
+        return self._fetchone("SELECT 1 FROM processed_videos WHERE video_id = ?", (str(video_id),)) is not None
+
+    def count_processed_videos(self):
+        return self._fetchone("SELECT COUNT(*) FROM processed_videos")[0]
+
+    def iter_processed_videos(self, batch_size=10000):
+        last_id = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT video_id FROM processed_videos WHERE video_id > ? ORDER BY video_id LIMIT ?",
+                    (last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for (video_id,) in rows:
+                yield video_id
+            last_id = rows[-1][0]
+
+    def add_processed_videos(self, conn, video_ids):
+        conn.executemany(
+            "INSERT OR IGNORE INTO processed_videos (video_id) VALUES (?)",
+            ((str(video_id),) for video_id in video_ids)
+        )
+
+    def get_run_metadata(self, key, default=None):
+        row = self._fetchone("SELECT value FROM run_metadata WHERE key = ?", (key,))
+        return json.loads(row[0]) if row else default
+
+    def set_run_metadata(self, conn, key, value):
+        conn.execute(
+            "INSERT INTO run_metadata (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value))
+        )
+
+    def import_json_state(self, json_path):
+        json_path = Path(json_path)
+        if not json_path.exists():
+            return False
+        try:
+            with open(json_path, 'r') as f:
+                state = json.load(f)
+            with self.transaction() as conn:
+                self.update_accounts(
+                    conn,
+                    last_user_update=state.get("last_user_update", {}),
+                    video_watermarks=state.get("video_watermarks", {})
+                )
+                self.add_processed_videos(conn, state.get("processed_videos", []))
+                if state.get("last_processed"):
+                    self.set_run_metadata(conn, "last_processed", state["last_processed"])
+            json_path.rename(json_path.with_suffix(".json.migrated"))
+            logger.info(f"Imported legacy pipeline state from {json_path}")
+            return True
+        except Exception as e:
+            logger.error(f"Error importing legacy pipeline state: {e}")
+            return False
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,99 @@
+import time
+import asyncio
+import logging
+from prometheus_client import Counter, Gauge, Histogram
+
+from config.config import SPARK_SINK_PARTITIONS
+from database import Database
+from rollups import refresh_user_windows
+
+logger = logging.getLogger(__name__)
+
+SINK_ROWS = Counter('stream_sink_rows_total', 'Rows written by the streaming sink', ['table', 'action'])
+SINK_BATCH_DURATION = Histogram('stream_sink_batch_seconds', 'Time to write one micro-batch into Postgres',
+                                buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+SINK_THROUGHPUT = Gauge('stream_sink_rows_per_second', 'Rows per second of the last micro-batch write', ['table'])
+SINK_LAST_BATCH = Gauge('stream_sink_last_batch_id', 'Last micro-batch written by the streaming sink', ['table'])
+
+REALTIME_COLUMNS = ["video_id", "observed_at", "user_id", "like_count", "comment_count",
+                    "view_count", "share_count", "engagement_score"]
+REALTIME_KEY = ("video_id", "observed_at")
+
+WINDOW_COLUMNS = ["video_id", "window_start", "window_end", "user_id", "snapshots", "like_count", "comment_count",
+                  "view_count", "share_count", "likes_gained", "views_gained", "shares_gained", "engagement_score"]
+WINDOW_KEY = ("video_id", "window_start", "window_end")
+
+async def refresh_windows(conn, rows):
+    return await refresh_user_windows(conn, {(row.user_id, row.window_start, row.window_end) for row in rows})
+
+async def upsert_rows(conn, table, columns, key, rows):
+    staging = f"staging_{table}"
+    column_list = ", ".join(columns)
+    key_list = ", ".join(key)
+    values = [column for column in columns if column not in key]
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in values)
+    changed = " OR ".join(f"{table}.{column} IS DISTINCT FROM EXCLUDED.{column}" for column in values)
+
+    await conn.execute(f"CREATE TEMP TABLE {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+    await conn.copy_records_to_table(staging, records=rows, columns=columns)
+    # Partitioned tables cannot return xmax, so a replayed row only shows up as not written
+    status = await conn.execute(f"""
+        INSERT INTO {table} ({column_list})
+        SELECT DISTINCT ON ({key_list}) {column_list} FROM {staging} ORDER BY {key_list}
+        ON CONFLICT ({key_list}) DO UPDATE SET {updates}, updated_at = CURRENT_TIMESTAMP
+        WHERE {changed}
+    """)
+    return int(status.split()[-1])
+
+async def write_rows(table, columns, key, rows, refresh=None):
+    database = Database(min_size=1, max_size=1)
+    try:
+        async with database.transaction() as conn:
+            values = [tuple(row[column] for column in columns) for row in rows]
+            written = await upsert_rows(conn, table, columns, key, values)
+            if refresh:
+                await refresh(conn, rows)
+            return written
+    finally:
+        await database.close()
+
+def partition_writer(table, columns, key, refresh=None):
+    # Runs on the executors, each Spark partition gets its own connection and COPY
+    def write(rows):
+        rows = list(rows)
+        yield len(rows), asyncio.run(write_rows(table, columns, key, rows, refresh)) if rows else 0
+    return write
+
+class PostgresSink:
+    def __init__(self, table="video_metrics_realtime", columns=REALTIME_COLUMNS, key=REALTIME_KEY,
+                 partitions=SPARK_SINK_PARTITIONS, partition_by=None, refresh=None):
+        self.table = table
+        self.columns = columns
+        self.key = key
+        self.partitions = partitions
+        self.partition_by = partition_by or key
+        self.refresh = refresh
+
+    def __call__(self, batch_df, batch_id):
+        start_time = time.perf_counter()
+        # Hashing on the key keeps all rows of a key in one task, so concurrent upserts never lock the same row
+        results = batch_df.repartition(self.partitions, *self.partition_by) \
+            .select(*self.columns) \
+            .rdd.mapPartitions(partition_writer(self.table, self.columns, self.key, self.refresh)) \
+            .collect()
+        duration = time.perf_counter() - start_time
+
+        rows = sum(result[0] for result in results)
+        written = sum(result[1] for result in results)
+        SINK_ROWS.labels(table=self.table, action="written").inc(written)
+        SINK_ROWS.labels(table=self.table, action="unchanged").inc(rows - written)
+        SINK_BATCH_DURATION.observe(duration)
+        SINK_THROUGHPUT.labels(table=self.table).set(rows / duration if duration else 0)
+        SINK_LAST_BATCH.labels(table=self.table).set(batch_id)
+        logger.info(f"Micro-batch {batch_id} into {self.table}: {rows} rows in {duration:.2f}s "
+                    f"({rows / duration if duration else 0:.0f} rows/s), {rows - written} already written")
+
+def window_sink():
+    # All windows of a user land in one task, which then refreshes the user rows on its own
+    return PostgresSink("video_engagement_window", WINDOW_COLUMNS, WINDOW_KEY,
+                        partition_by=("user_id",), refresh=refresh_windows)
@@ -1,18 +1,27 @@
+import os
+import copy
 import time
 import random
 import logging
 import asyncio
 import nest_asyncio
 from functools import wraps
+from prometheus_client import Counter
 
 from config.config import (
-    TOKEN_CACHE_TTL
+    TOKEN_CACHE_TTL, TOKEN_REFRESH_ENABLED,
+    API_SESSION_POOL_SIZE, VIDEO_PAGE_SIZE, VIDEO_MAX_PAGES, get_session_token_sets
 )
+from rate_limiter import RateLimiter
+from response_cache import ResponseCache
+from session_pool import SessionPool, create_api
 
 logger = logging.getLogger(__name__)
 
 nest_asyncio.apply()
 
+COALESCED_REQUESTS = Counter('api_coalesced_requests_total', 'API calls saved by joining an identical in-flight request', ['endpoint'])
+
 def log_api_call(func):
     @wraps(func)
     async def wrapper(*args, **kwargs):
@@ -29,53 +38,66 @@ def log_api_call(func):
     return wrapper
 
 class TikTokAPIClient:
-    def __init__(self):
+    def __init__(self, rate_limiter=None, pool_size=None, response_cache=None, api_factory=None, token_manager=None):
         self.max_retries = 3
         self.retry_delay = 2
         self.timeout = 60.0
-        self.api_instance = None
+        self.session_pool = None
+        self._pool_lock = None
+        self._pool_size = pool_size or API_SESSION_POOL_SIZE
+        self._api_factory = api_factory or create_api
         self._loop = asyncio.get_event_loop()
         self._token_cache = {}
-        self._response_cache = {}
-        
-        try:
-            self.api_instance = self._loop.run_until_complete(self.initialize_api())
-            if not self.api_instance:
-                logger.warning("Failed to initialize TikTokApi. Some TikTok API operations will fail.")
-        except Exception as e:
-            logger.error(f"Error initializing TikTokApi: {e}")
+        self.response_cache = response_cache or ResponseCache.from_config()
+        self._in_flight = {}
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.token_manager = token_manager
+        if self.token_manager is None and TOKEN_REFRESH_ENABLED:
+            from token_extractor import TokenManager
+            self.token_manager = TokenManager()
+        if self.token_manager is not None:
+            self.token_manager.subscribe(self._on_tokens_refreshed)
     
     async def initialize_api(self):
-        logger.info("Initializing TikTokApi instance")
-        
-        ms_token = self._get_cached_token("MS_TOKEN")
-        verify_fp = self._get_cached_token("TIKTOK_VERIFY_FP")
-        session_id = self._get_cached_token("TIKTOK_SESSIONID")
+        logger.info(f"Initializing TikTokApi session pool of {self._pool_size} sessions")
         
-        if not any([ms_token, verify_fp, session_id]):
+        token_sets = get_session_token_sets()
+        if not token_sets and not any(self._get_default_tokens().values()):
             logger.warning("No authentication tokens found. Please run get_tokens.py to obtain them.")
         
         try:
-            from TikTokApi import TikTokApi
-            api = TikTokApi(custom_verify_fp=verify_fp)
-            await api.create_sessions(
-                ms_tokens=[ms_token] if ms_token else None,
-                session_ids=[session_id] if session_id else None,
-                num_sessions=1,
-                headless=True
-            )
-            return api
+            pool = SessionPool(self._get_session_tokens, size=self._pool_size, api_factory=self._api_factory)
+            if await pool.start():
+                return pool
+            await pool.close()
+            return None
         except Exception as e:
             logger.error(f"Failed to initialize TikTokApi: {e}")
             return None
 
+    def _get_default_tokens(self):
+        if self.token_manager is not None and self.token_manager.tokens:
+            return self.token_manager.current()
+        return {
+            "ms_token": self._get_cached_token("MS_TOKEN"),
+            "verify_fp": self._get_cached_token("TIKTOK_VERIFY_FP"),
+            "session_id": self._get_cached_token("TIKTOK_SESSIONID")
+        }
+
+    def _get_session_tokens(self, index):
+        token_sets = get_session_token_sets()
+        if token_sets:
+            return token_sets[index % len(token_sets)]
+        return self._get_default_tokens()
+
     def _get_cached_token(self, token_name):
         if token_name in self._token_cache:
             token_data = self._token_cache[token_name]
             if time.time() - token_data["timestamp"] < TOKEN_CACHE_TTL:
                 return token_data["value"]
         
-        token_value = globals()[token_name]
+        # Same variables config.py reads, after load_dotenv has populated them
+        token_value = os.getenv(token_name)
         if token_value:
             self._token_cache[token_name] = {
                 "value": token_value,
@@ -83,12 +105,49 @@ class TikTokAPIClient:
             }
         return token_value
 
-    async def _make_request_with_retry(self, operation, *args, retries=0, **kwargs):
+    async def _single_flight(self, key, request):
+        future = self._in_flight.get(key)
+        if future is not None:
+            COALESCED_REQUESTS.labels(endpoint=key[0]).inc()
+            return copy.deepcopy(await asyncio.shield(future))
+        
+        future = asyncio.ensure_future(request())
+        self._in_flight[key] = future
+        future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _ensure_session_pool(self):
+        # Browsers are launched on the first request, so runs that hit the cache never start one
+        if self.session_pool:
+            return True
+        if self._pool_lock is None:
+            self._pool_lock = asyncio.Lock()
+        async with self._pool_lock:
+            if not self.session_pool:
+                if self.token_manager is not None:
+                    # Fresh tokens first, so the sessions do not start on expired ones
+                    await self.token_manager.start()
+                self.session_pool = await self.initialize_api()
+                if not self.session_pool:
+                    logger.warning("Failed to initialize TikTokApi. Some TikTok API operations will fail.")
+        return self.session_pool is not None
+
+    async def _call_endpoint(self, endpoint, *args, **kwargs):
+        async with self.session_pool.lease() as api:
+            operation = api
+            for attribute in endpoint.split("."):
+                operation = getattr(operation, attribute)
+            return await operation(*args, **kwargs)
+
+    async def _make_request_with_retry(self, endpoint, *args, retries=0, **kwargs):
         if retries >= self.max_retries:
             raise Exception("Max retries reached for operation")
         
+        await self.rate_limiter.acquire(endpoint)
         try:
-            return await operation(*args, **kwargs)
+            result = await self._call_endpoint(endpoint, *args, **kwargs)
+            self.rate_limiter.on_success(endpoint)
+            return result
         except Exception as e:
             error_message = str(e).lower()
             
@@ -99,21 +158,22 @@ class TikTokAPIClient:
             
             if "too many requests" in error_message or "429" in error_message:
                 wait_time = int(self.retry_delay * (2 ** retries))
-                logger.warning(f"Rate limit hit. Waiting {wait_time} seconds")
-                await asyncio.sleep(wait_time)
-                return await self._make_request_with_retry(operation, *args, retries=retries+1, **kwargs)
+                logger.warning(f"Rate limit hit on {endpoint}. Pausing endpoint for {wait_time} seconds")
+                self.rate_limiter.on_throttle(endpoint, retry_after=wait_time)
+                return await self._make_request_with_retry(endpoint, *args, retries=retries+1, **kwargs)
             
             elif "503" in error_message:  # Service unavailable
                 wait_time = self.retry_delay * (2 ** retries) + random.uniform(0, 1)
                 logger.warning(f"Service unavailable. Waiting {wait_time:.2f} seconds")
+                self.rate_limiter.on_throttle(endpoint)
                 await asyncio.sleep(wait_time)
-                return await self._make_request_with_retry(operation, *args, retries=retries+1, **kwargs)
+                return await self._make_request_with_retry(endpoint, *args, retries=retries+1, **kwargs)
             
             elif "timeout" in error_message:
                 wait_time = self.retry_delay * (2 ** retries) + random.uniform(1, 5)
                 logger.warning(f"Timeout error. Waiting {wait_time:.2f} seconds and retrying...")
                 await asyncio.sleep(wait_time)
-                return await self._make_request_with_retry(operation, *args, retries=retries+1, **kwargs)
+                return await self._make_request_with_retry(endpoint, *args, retries=retries+1, **kwargs)
             
             else:
                 logger.error(f"Request failed: {e}")
@@ -122,15 +182,26 @@ class TikTokAPIClient:
     def _clear_token_cache(self):
         self._token_cache.clear()
         logger.info("Token cache cleared")
+        if self.token_manager is not None:
+            self.token_manager.request_refresh()
+
+    async def _on_tokens_refreshed(self, tokens):
+        self._token_cache.clear()
+        if self.session_pool and not get_session_token_sets():
+            logger.info("Swapping refreshed tokens into the session pool")
+            await self.session_pool.rotate_tokens()
 
     async def close_api(self):
-        if self.api_instance:
+        self.response_cache.save()
+        if self.session_pool:
             try:
-                logger.info("Closing TikTokApi instance")
-                await self.api_instance.close_sessions()
-                self.api_instance = None
+                logger.info("Closing TikTokApi session pool")
+                await self.session_pool.close()
+                self.session_pool = None
             except Exception as e:
                 logger.error(f"Error closing TikTokApi: {e}")
+        if self.token_manager is not None:
+            await self.token_manager.close()
 
     @log_api_call
     async def get_user_info(self, username, full_url=None):
@@ -141,15 +212,22 @@ class TikTokAPIClient:
                 
         logger.info(f"Getting info for user: {username}")
         
-        if not self.api_instance:
-            self.api_instance = await self.initialize_api()
-        if not self.api_instance:
+        cached = self.response_cache.get("user.info", username)
+        if cached is not None:
+            return cached
+        
+        return await self._single_flight(
+            ("user.info", username), lambda: self._request_user_info(username)
+        )
+
+    async def _request_user_info(self, username):
+        if not await self._ensure_session_pool():
             logger.error(f"API not initialized, cannot get user info for {username}")
             return {"user_info": {}}
         
         try:
             user = await self._make_request_with_retry(
-                self.api_instance.user.info, username
+                "user.info", username
             )
             
             if not user:
@@ -159,7 +237,7 @@ class TikTokAPIClient:
             user_stats = user.get("userInfo", {}).get("stats", {})
             user_info = user.get("userInfo", {})
             
-            return {
+            result = {
                 "user_info": {
                     "id": user_info.get("user", {}).get("id"),
                     "nickname": user_info.get("user", {}).get("nickname"),
@@ -170,51 +248,103 @@ class TikTokAPIClient:
                     "video_count": user_stats.get("videoCount")
                 }
             }
+            self.response_cache.set("user.info", username, result)
+            return result
         except Exception as e:
             logger.error(f"Error getting user info for {username}: {e}")
             return {"user_info": {}}
 
+    def _parse_video(self, video):
+        stats = video.get("stats", {})
+        create_time = int(video.get("createTime", 0))
+        
+        return {
+            "id": video.get("id"),
+            "desc": video.get("desc", ""),
+            "create_time": create_time,
+            "pinned": bool(video.get("isPinnedItem", False)),
+            "statistics": {
+                "like_count": stats.get("diggCount", 0),
+                "comment_count": stats.get("commentCount", 0),
+                "view_count": stats.get("playCount", 0),
+                "share_count": stats.get("shareCount", 0)
+            }
+        }
+
+    def _parse_video_page(self, response, count):
+        if isinstance(response, dict):
+            items = response.get("itemList") or []
+            videos = [self._parse_video(video) for video in items]
+            return videos, response.get("cursor"), bool(response.get("hasMore")) and bool(videos)
+        
+        videos = [self._parse_video(video) for video in response or []]
+        # Plain lists carry no cursor, the next page starts before the oldest video returned
+        next_cursor = min(video["create_time"] for video in videos) * 1000 if videos else None
+        return videos, next_cursor, len(videos) >= count
+
+    async def _fetch_video_page(self, username, cursor, count):
+        page = self.response_cache.get("user.videos", username, cursor, count)
+        if page is None:
+            page = await self._single_flight(
+                ("user.videos", username, cursor, count),
+                lambda: self._request_video_page(username, cursor, count)
+            )
+        return page["videos"], page["cursor"], page["has_more"]
+
+    async def _request_video_page(self, username, cursor, count):
+        response = await self._make_request_with_retry(
+            "user.videos", username, count=count, cursor=cursor or 0
+        )
+        videos, next_cursor, has_more = self._parse_video_page(response, count)
+        page = {"videos": videos, "cursor": next_cursor, "has_more": has_more}
+        self.response_cache.set("user.videos", username, page, cursor, count)
+        return page
+
+    async def iter_user_video_pages(self, username, since=None, page_size=VIDEO_PAGE_SIZE, max_pages=VIDEO_MAX_PAGES):
+        if not await self._ensure_session_pool():
+            logger.error(f"API not initialized, cannot get videos for {username}")
+            return
+        
+        cursor = None
+        pages = 0
+        while True:
+            videos, next_cursor, has_more = await self._fetch_video_page(username, cursor, page_size)
+            pages += 1
+            
+            # Pinned videos are shown first regardless of age and must not stop the scan
+            reached_watermark = since is not None and any(
+                v["create_time"] <= since and not v["pinned"] for v in videos
+            )
+            
+            if videos:
+                yield videos
+            
+            if reached_watermark:
+                logger.info(f"Reached watermark for {username} after {pages} pages")
+                return
+            if not has_more or next_cursor is None or next_cursor == cursor:
+                return
+            if max_pages and pages >= max_pages:
+                logger.warning(f"Stopped paginating videos for {username} after {pages} pages")
+                return
+            cursor = next_cursor
+
     @log_api_call
     async def get_user_videos(self, username, cursor=None, count=20):
         logger.info(f"Getting videos for user: {username}")
         
-        if not self.api_instance:
-            self.api_instance = await self.initialize_api()
-            
-        if not self.api_instance:
+        if not await self._ensure_session_pool():
             logger.error(f"API not initialized, cannot get videos for {username}")
             return []
         
         try:
-            user_videos = await self._make_request_with_retry(
-                self.api_instance.user.videos, username, count=count
-            )
+            videos, _, _ = await self._fetch_video_page(username, cursor, count)
             
-            if not user_videos:
+            if not videos:
                 logger.error(f"No videos returned for {username}")
                 return []
             
-            videos = []
-            for video in user_videos:
-                stats = video.get("stats", {})
-                create_time = int(video.get("createTime", 0)) 
-                
-                videos.append({
-                    "id": video.get("id"),
-                    "desc": video.get("desc", ""),
-                    "create_time": create_time,
-                    "statistics": {
-                        "like_count": stats.get("diggCount", 0),
-                        "comment_count": stats.get("commentCount", 0),
-                        "view_count": stats.get("playCount", 0),
-                        "share_count": stats.get("shareCount", 0)
-                    }
-                })
-                
-                if len(videos) >= count:
-                    break
-            
-            return videos
+            return videos[:count]
         except Exception as e:
             logger.error(f"Error getting videos for user {username}: {e}")
             return []
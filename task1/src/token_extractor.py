@@ -2,25 +2,38 @@
 
 import os
 import sys
+import time
 import logging
 import asyncio
 import argparse
 from dotenv import load_dotenv, set_key
 from playwright.async_api import async_playwright
+from prometheus_client import Counter, Gauge
+
+from config.config import TOKEN_CACHE_TTL, TOKEN_REFRESH_MARGIN, TOKEN_PROFILE_DIR
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger("token_extractor")
 
 ENV_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env')
 
-async def get_tiktok_tokens(username, password, headless=False):
+COOKIE_MAPPING = {
+    'msToken': 'MS_TOKEN',
+    's_v_web_id': 'TIKTOK_VERIFY_FP',
+    'sessionid': 'TIKTOK_SESSIONID'
+}
+
+TOKEN_AGE = Gauge('api_token_age_seconds', 'Seconds since the TikTok tokens in use were refreshed')
+TOKEN_REFRESHES = Counter('api_token_refreshes_total', 'Background TikTok token refreshes', ['result'])
+
+def tokens_from_cookies(cookies):
+    return {COOKIE_MAPPING[cookie['name']]: cookie['value']
+            for cookie in cookies if cookie.get('name') in COOKIE_MAPPING and cookie.get('value')}
+
+async def get_tiktok_tokens(username, password, headless=False, profile_dir=TOKEN_PROFILE_DIR):
     
     async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=headless)
-        context = await browser.new_context()
+        # The login is kept in the profile, so TokenManager can refresh tokens later without it
+        context = await p.chromium.launch_persistent_context(str(profile_dir), headless=headless)
         page = await context.new_page()
         
         try:
@@ -65,36 +78,23 @@ async def get_tiktok_tokens(username, password, headless=False):
                 
                 if not auth_completed:
                     logger.error("Authorization timeout exceeded")
-                    await browser.close()
+                    await context.close()
                     return None
             
             logger.info("Authorization successful, we receive tokens...")
-            cookies = await context.cookies()
-            
-            tokens = {}
-            cookie_mapping = {
-                'msToken': 'MS_TOKEN',
-                's_v_web_id': 'TIKTOK_VERIFY_FP',
-                'sessionid': 'TIKTOK_SESSIONID'
-            }
-            
-            for cookie in cookies:
-                name = cookie.get('name')
-                if name in cookie_mapping:
-                    env_name = cookie_mapping[name]
-                    tokens[env_name] = cookie.get('value')
+            tokens = tokens_from_cookies(await context.cookies())
             
             logger.info(f"Received {len(tokens)} tokens")
             
             await page.screenshot(path='tiktok_auth_screenshot.png')
             
-            await browser.close()
+            await context.close()
             return tokens
         
         except Exception as e:
             logger.error(f"Error while getting tokens: {e}")
             await page.screenshot(path='tiktok_auth_error.png')
-            await browser.close()
+            await context.close()
             return None
 
 def update_env_file(tokens):
@@ -111,7 +111,114 @@ def update_env_file(tokens):
     
     return True
 
+class TokenManager:
+    def __init__(self, profile_dir=TOKEN_PROFILE_DIR, ttl=TOKEN_CACHE_TTL, refresh_margin=TOKEN_REFRESH_MARGIN,
+                 env_path=ENV_PATH, headless=True):
+        self.profile_dir = profile_dir
+        self.ttl = ttl
+        self.refresh_margin = min(refresh_margin, ttl / 2)
+        self.env_path = env_path
+        self.headless = headless
+        self.tokens = {}
+        self.refreshed_at = None
+        self._listeners = []
+        self._playwright = None
+        self._context = None
+        self._task = None
+        self._wake = None
+        self._failed = False
+        TOKEN_AGE.set_function(lambda: time.time() - self.refreshed_at if self.refreshed_at else 0)
+
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def current(self):
+        return {
+            "ms_token": self.tokens.get("MS_TOKEN"),
+            "verify_fp": self.tokens.get("TIKTOK_VERIFY_FP"),
+            "session_id": self.tokens.get("TIKTOK_SESSIONID")
+        }
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._playwright = await async_playwright().start()
+        self._context = await self._playwright.chromium.launch_persistent_context(
+            str(self.profile_dir), headless=self.headless
+        )
+        self._wake = asyncio.Event()
+        await self._try_refresh()
+        self._task = asyncio.ensure_future(self._refresh_forever())
+
+    async def refresh(self):
+        page = self._context.pages[0] if self._context.pages else await self._context.new_page()
+        # Visiting the site lets TikTok rotate msToken in the cookies of the persistent profile
+        await page.goto('https://www.tiktok.com/', wait_until='domcontentloaded')
+        await page.wait_for_timeout(3000)
+        tokens = tokens_from_cookies(await self._context.cookies('https://www.tiktok.com'))
+        if not tokens.get('MS_TOKEN'):
+            raise Exception("No msToken in the browser profile cookies")
+        if self.tokens.get('TIKTOK_SESSIONID') and not tokens.get('TIKTOK_SESSIONID'):
+            logger.warning("TikTok login in the token profile has expired, run get_tokens.py again")
+        
+        changed = tokens != self.tokens
+        self.tokens = tokens
+        self.refreshed_at = time.time()
+        TOKEN_REFRESHES.labels(result="ok").inc()
+        if changed:
+            logger.info(f"Refreshed TikTok tokens: {', '.join(sorted(tokens))}")
+            update_env_file(tokens)
+            for callback in self._listeners:
+                await callback(self.current())
+        return tokens
+
+    def request_refresh(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _try_refresh(self):
+        try:
+            await self.refresh()
+            self._failed = False
+        except Exception as e:
+            TOKEN_REFRESHES.labels(result="error").inc()
+            logger.error(f"Error refreshing TikTok tokens: {e}")
+            self._failed = True
+
+    async def _refresh_forever(self):
+        while True:
+            # Refresh ahead of TOKEN_CACHE_TTL so no request ever runs on an expired token
+            if self._failed:
+                delay = self.refresh_margin / 5
+            else:
+                delay = self.ttl - self.refresh_margin - (time.time() - self.refreshed_at)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(1.0, delay))
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self._try_refresh()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._context is not None:
+            await self._context.close()
+            self._context = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
 async def main_async(username, password, headless=False):
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
     tokens = await get_tiktok_tokens(username, password, headless)
     if tokens:
         update_env_file(tokens)
@@ -0,0 +1,78 @@
+import gzip
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+from fake_tiktok_api import FakeBackend
+from records import VideoRecord, to_records
+from response_cache import ResponseCache
+from tiktok_api import TikTokAPIClient
+from wire_format import JsonSerializer, MsgpackSerializer, SchemaRegistry
+
+def build_videos(count):
+    backend = FakeBackend()
+    api_client = TikTokAPIClient(response_cache=ResponseCache(ttl=0, path=None))
+    payloads = []
+    account = 0
+    while len(payloads) < count:
+        for video in backend.user_videos(f"bench_user_{account}"):
+            payload = api_client._parse_video(video)
+            payload["user_id"] = f"user_{account}"
+            payloads.append(payload)
+        account += 1
+    return [video.to_dict() for video in to_records(VideoRecord, payloads[:count])]
+
+def measure(serializer, videos, repeat):
+    messages = [serializer.encode("video_data", video) for video in videos]
+    encode_time = decode_time = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for video in videos:
+            serializer.encode("video_data", video)
+        encode_time = min(encode_time, time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        for message in messages:
+            serializer.decode(message)
+        decode_time = min(decode_time, time.perf_counter() - start_time)
+
+    return {
+        "bytes": sum(len(message) for message in messages) / len(messages),
+        # Kafka compresses whole batches, so compare the formats the way the broker stores them
+        "gzip_bytes": len(gzip.compress(b"".join(messages))) / len(messages),
+        "encode_us": encode_time / len(videos) * 1e6,
+        "decode_us": decode_time / len(videos) * 1e6
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare Kafka wire formats for video messages")
+    parser.add_argument("--messages", type=int, default=100000, help="Number of video messages (default: 100000)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing runs per format, the best one is reported (default: 3)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    videos = build_videos(args.messages)
+
+    with tempfile.TemporaryDirectory() as registry_dir:
+        registry = SchemaRegistry(str(Path(registry_dir) / "registry.json"))
+        results = {
+            "json": measure(JsonSerializer(), videos, args.repeat),
+            "msgpack": measure(MsgpackSerializer(registry), videos, args.repeat)
+        }
+
+    print(f"Wire format benchmark, {len(videos):,} video messages")
+    print(f"  {'format':<10} {'bytes/msg':>10} {'gzip bytes/msg':>15} {'encode us/msg':>14} {'decode us/msg':>14}")
+    for wire_format, result in results.items():
+        print(f"  {wire_format:<10} {result['bytes']:>10.1f} {result['gzip_bytes']:>15.1f} "
+              f"{result['encode_us']:>14.2f} {result['decode_us']:>14.2f}")
+
+    json_result, msgpack_result = results["json"], results["msgpack"]
+    print(f"msgpack vs json: {msgpack_result['bytes'] / json_result['bytes']:.0%} of the bytes, "
+          f"{msgpack_result['gzip_bytes'] / json_result['gzip_bytes']:.0%} after gzip, "
+          f"encode x{json_result['encode_us'] / msgpack_result['encode_us']:.1f}, "
+          f"decode x{json_result['decode_us'] / msgpack_result['decode_us']:.1f}")
+
+if __name__ == "__main__":
+    main()
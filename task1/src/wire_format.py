@@ -0,0 +1,150 @@
+import os
+import json
+import fcntl
+import struct
+import logging
+from datetime import datetime, timezone
+
+import msgpack
+
+from config.config import STATE_DIR, SCHEMA_REGISTRY_PATH
+
+logger = logging.getLogger(__name__)
+
+MAGIC_BYTE = 0
+HEADER = struct.Struct(">bI")
+
+# Field order is the wire order, new fields are appended so older schema IDs stay readable
+RECORD_SCHEMAS = {
+    "user_data": [
+        ("id", "string"), ("username", "string"), ("display_name", "string"), ("bio", "string"),
+        ("follower_count", "long"), ("following_count", "long"), ("heart_count", "long"), ("video_count", "long")
+    ],
+    "video_data": [
+        ("id", "string"), ("user_id", "string"), ("caption", "string"), ("create_time", "timestamp"),
+        ("like_count", "long"), ("comment_count", "long"), ("view_count", "long"), ("share_count", "long"),
+        ("collected_at", "timestamp")
+    ]
+}
+
+class DateTimeEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, datetime):
+            return obj.isoformat()
+        return super(DateTimeEncoder, self).default(obj)
+
+def _to_wire(value, field_type):
+    if value is None or field_type != "timestamp":
+        return value
+    # Records carry naive UTC datetimes, the wire carries epoch milliseconds
+    return int(value.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+def _from_wire(value, field_type):
+    if value is None or field_type != "timestamp":
+        return value
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc).replace(tzinfo=None)
+
+class SchemaRegistry:
+    def __init__(self, path=SCHEMA_REGISTRY_PATH, lock_path=STATE_DIR / "schema_registry.lock"):
+        self.path = path
+        self.lock_path = lock_path
+        self._schemas = {}
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f).get("schemas", [])
+
+    def _cache(self, schemas):
+        self._schemas = {
+            schema["id"]: (schema["subject"], [(field["name"], field["type"]) for field in schema["fields"]])
+            for schema in schemas
+        }
+
+    def register(self, subject, fields):
+        fields = [(name, field_type) for name, field_type in fields]
+        for schema_id, known in self._schemas.items():
+            if known == (subject, fields):
+                return schema_id
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Producers and consumers on one host share the file, the lock keeps IDs unique
+        with open(self.lock_path, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            schemas = self._read()
+            self._cache(schemas)
+            for schema_id, known in self._schemas.items():
+                if known == (subject, fields):
+                    return schema_id
+
+            schema_id = max((schema["id"] for schema in schemas), default=0) + 1
+            schemas.append({
+                "id": schema_id,
+                "subject": subject,
+                "fields": [{"name": name, "type": field_type} for name, field_type in fields]
+            })
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"schemas": schemas}, f, indent=2)
+            os.replace(tmp_path, self.path)
+            self._cache(schemas)
+        logger.info(f"Registered schema {schema_id} for {subject}")
+        return schema_id
+
+    def get(self, schema_id):
+        if schema_id not in self._schemas:
+            self._cache(self._read())
+        if schema_id not in self._schemas:
+            raise KeyError(f"Unknown schema ID {schema_id}")
+        return self._schemas[schema_id]
+
+class JsonSerializer:
+    def encode(self, message_type, data):
+        return json.dumps({"type": message_type, "data": data}, cls=DateTimeEncoder).encode('utf-8')
+
+    def decode(self, payload):
+        envelope = json.loads(payload)
+        return envelope["type"], envelope["data"]
+
+class MsgpackSerializer:
+    def __init__(self, registry=None, schemas=RECORD_SCHEMAS):
+        self.registry = registry or SchemaRegistry()
+        self.schemas = schemas
+        self._ids = {}
+        self._readers = {}
+
+    def schema_id(self, message_type):
+        if message_type not in self._ids:
+            self._ids[message_type] = self.registry.register(message_type, self.schemas[message_type])
+        return self._ids[message_type]
+
+    def encode(self, message_type, data):
+        schema_id = self.schema_id(message_type)
+        # Values go out as an array in schema order, field names live only in the registry
+        values = [_to_wire(data.get(name), field_type) for name, field_type in self.schemas[message_type]]
+        return HEADER.pack(MAGIC_BYTE, schema_id) + msgpack.packb(values, use_bin_type=True)
+
+    def _reader(self, schema_id):
+        if schema_id not in self._readers:
+            subject, fields = self.registry.get(schema_id)
+            timestamps = [name for name, field_type in fields if field_type == "timestamp"]
+            self._readers[schema_id] = (subject, [name for name, _ in fields], timestamps)
+        return self._readers[schema_id]
+
+    def decode(self, payload):
+        magic, schema_id = HEADER.unpack_from(payload)
+        if magic != MAGIC_BYTE:
+            raise ValueError(f"Unknown wire format magic byte {magic}")
+        subject, names, timestamps = self._reader(schema_id)
+        data = dict(zip(names, msgpack.unpackb(payload[HEADER.size:], raw=False)))
+        for name in timestamps:
+            data[name] = _from_wire(data[name], "timestamp")
+        return subject, data
+
+def create_serializer(wire_format, registry=None):
+    if wire_format == "json":
+        return JsonSerializer()
+    if wire_format == "msgpack":
+        return MsgpackSerializer(registry)
+    raise ValueError(f"Unknown Kafka wire format: {wire_format}")
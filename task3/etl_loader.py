@@ -5,7 +5,7 @@ import asyncpg
 import time
 import pandas as pd
 from datetime import datetime
-from typing import Dict, Any, Set, Tuple
+from typing import Dict, Any, List, Optional, Set, Tuple
 
 DEFAULT_BATCH_SIZE = 1000
 DEFAULT_POOL_SIZE = 20
@@ -13,14 +13,19 @@ DEFAULT_HOST = "localhost"
 DEFAULT_DATABASE = "tiktok_streaming"
 DEFAULT_USER = "postgres"
 DEFAULT_PASSWORD = "postgres"
+DEFAULT_PARTITION_PREMAKE = 3
 GOOGLE_SHEET_URL = "https://docs.google.com/spreadsheets/d/1Hh9wPMVThGmXrctBrG15eOux8l5I9m5T1vaRisHqpF4/export?format=csv&gid=431063534"
 
 async def create_tables(pool: asyncpg.Pool) -> None:
     try:
+        # Shared with the task1 pipeline, the functions have a single source
+        with open('task1/migrations/partition_maintenance.sql', 'r', encoding='utf-8') as f:
+            partition_sql = f.read()
         with open('task3/sql/create_schema.sql', 'r', encoding='utf-8') as f:
             schema_sql = f.read()
         
         async with pool.acquire() as conn:
+            await conn.execute(partition_sql)
             await conn.execute(schema_sql)
     except Exception as e:
         print(f"Error creating schema: {e}")
@@ -56,6 +61,28 @@ async def create_tables(pool: asyncpg.Pool) -> None:
         async with pool.acquire() as conn:
             await conn.execute(create_table_query)
 
+async def maintain_partitions(
+    pool: asyncpg.Pool,
+    premake: int,
+    retention: Optional[str],
+    drop_expired: bool
+) -> List[asyncpg.Record]:
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                changes = await conn.fetch(
+                    "SELECT * FROM maintain_range_partitions('orders', INTERVAL '1 month', $1, $2::text::interval, $3)",
+                    premake, retention, drop_expired
+                )
+    except asyncpg.PostgresError as e:
+        print(f"Error maintaining partitions: {e}")
+        return []
+    
+    for change in changes:
+        moved = f" ({change['row_count']} rows moved)" if change['row_count'] else ""
+        print(f"Partition {change['partition_name']}: {change['action']}{moved}")
+    return changes
+
 async def extract_reference_data(df: pd.DataFrame) -> Tuple[Set[str], Set[Tuple[str, str]], Set[str]]:
     all_subjects = set()
     for subjects_str in df['subjects'].dropna():
@@ -276,7 +303,10 @@ async def run_etl(
     host: str,
     database: str,
     user: str,
-    password: str
+    password: str,
+    partition_premake: int = DEFAULT_PARTITION_PREMAKE,
+    partition_retention: Optional[str] = None,
+    drop_expired_partitions: bool = False
 ) -> Dict[str, Any]:
     start_time = time.time()
     
@@ -292,6 +322,9 @@ async def run_etl(
     try:
         await create_tables(pool)
         result = await load_data_from_google_sheets(pool, sheet_url, batch_size)
+        # Loaded orders go to orders_default first, maintenance moves them into monthly partitions
+        changes = await maintain_partitions(pool, partition_premake, partition_retention, drop_expired_partitions)
+        result["partitions_changed"] = len(changes)
         end_time = time.time()
         result["total_etl_duration"] = end_time - start_time
         return result
@@ -307,6 +340,9 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument('--database', default=DEFAULT_DATABASE, help=f'Database name (default: {DEFAULT_DATABASE})')
     parser.add_argument('--user', default=DEFAULT_USER, help=f'Database user (default: {DEFAULT_USER})')
     parser.add_argument('--password', default=DEFAULT_PASSWORD, help=f'Database password (default: {DEFAULT_PASSWORD})')
+    parser.add_argument('--partition-premake', type=int, default=DEFAULT_PARTITION_PREMAKE, help=f'Monthly partitions created ahead (default: {DEFAULT_PARTITION_PREMAKE})')
+    parser.add_argument('--partition-retention', default=None, help='Detach partitions older than this interval, e.g. "24 months" (default: keep all)')
+    parser.add_argument('--drop-expired-partitions', action='store_true', help='Drop expired partitions instead of detaching them')
     return parser.parse_args()
 
 async def main() -> None:
@@ -325,7 +361,10 @@ async def main() -> None:
             host=args.host,
             database=args.database,
             user=args.user,
-            password=args.password
+            password=args.password,
+            partition_premake=args.partition_premake,
+            partition_retention=args.partition_retention,
+            drop_expired_partitions=args.drop_expired_partitions
         )
         
         print("\nETL process completed successfully")
@@ -334,6 +373,7 @@ async def main() -> None:
         print(f"Data loading duration: {result['duration_seconds']:.2f} seconds")
         print(f"Records per second: {result['records_per_second']:.2f}")
         print(f"Total batches: {result['total_batches']}")
+        print(f"Partitions changed: {result['partitions_changed']}")
         
     except Exception as e:
         print(f"ETL process failed with error: {str(e)}")
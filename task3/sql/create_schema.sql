@@ -32,51 +32,44 @@ CREATE TABLE IF NOT EXISTS package_courses (
 
 -- Create partitioned orders table by order_date (range partitioning)
 CREATE TABLE IF NOT EXISTS orders (
-    order_id SERIAL PRIMARY KEY,
+    order_id SERIAL,
     user_id INTEGER NOT NULL,
     course_id INTEGER REFERENCES courses(course_id),
     package_id INTEGER REFERENCES packages(package_id),
     order_date DATE NOT NULL,
     amount NUMERIC(10, 2) NOT NULL,
-    payment_status VARCHAR(20) NOT NULL
+    payment_status VARCHAR(20) NOT NULL,
+    PRIMARY KEY (order_id, order_date)
 ) PARTITION BY RANGE (order_date);
 
--- Create partitions by month
--- We'll create partitions for 2023 as an example
-CREATE TABLE orders_2023_01 PARTITION OF orders
-    FOR VALUES FROM ('2023-01-01') TO ('2023-02-01');
-    
-CREATE TABLE orders_2023_02 PARTITION OF orders
-    FOR VALUES FROM ('2023-02-01') TO ('2023-03-01');
-    
-CREATE TABLE orders_2023_03 PARTITION OF orders
-    FOR VALUES FROM ('2023-03-01') TO ('2023-04-01');
-    
--- Add more partitions as needed...
-
-CREATE TABLE orders_default PARTITION OF orders
+-- Orders outside the monthly partitions land here until maintain_range_partitions moves them out
+CREATE TABLE IF NOT EXISTS orders_default PARTITION OF orders
     DEFAULT;
 
+-- Monthly partitions from the current month ahead (functions from task1/migrations/partition_maintenance.sql).
+-- Historical months are split out of orders_default after the load.
+SELECT * FROM maintain_range_partitions('orders', INTERVAL '1 month', 3);
+
 -- 2. Create indexes for common query patterns
 
 -- Index on the partitioning key (order_date) 
-CREATE INDEX idx_orders_date ON orders(order_date);
+CREATE INDEX IF NOT EXISTS idx_orders_date ON orders(order_date);
 
 -- Index for user queries
-CREATE INDEX idx_orders_user_id ON orders(user_id);
+CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id);
 
 -- Indexes for course/package lookups
-CREATE INDEX idx_orders_course_id ON orders(course_id);
-CREATE INDEX idx_orders_package_id ON orders(package_id);
+CREATE INDEX IF NOT EXISTS idx_orders_course_id ON orders(course_id);
+CREATE INDEX IF NOT EXISTS idx_orders_package_id ON orders(package_id);
 
 -- Compound index for course sales analysis
-CREATE INDEX idx_course_date ON orders(course_id, order_date);
+CREATE INDEX IF NOT EXISTS idx_course_date ON orders(course_id, order_date);
 
 -- Compound index for package sales analysis
-CREATE INDEX idx_package_date ON orders(package_id, order_date);
+CREATE INDEX IF NOT EXISTS idx_package_date ON orders(package_id, order_date);
 
 -- For the status-based queries
-CREATE INDEX idx_payment_status ON orders(payment_status);
+CREATE INDEX IF NOT EXISTS idx_payment_status ON orders(payment_status);
 
 -- 3. Set up database parameters for bulk loading (these would normally be in postgresql.conf)
 -- These are just examples; actual values would depend on available system resources
@@ -90,13 +83,14 @@ wal_buffers = 16MB              -- Larger WAL buffers
 */
 
 -- 4. Configure storage parameters for performance
-ALTER TABLE orders SET (
+-- Partitioned tables hold no storage parameters, set them on the partition bulk loads land in
+ALTER TABLE orders_default SET (
     autovacuum_vacuum_scale_factor = 0.1,
     autovacuum_analyze_scale_factor = 0.05
 );
 
 -- Create temporary tables for bulk loading
-CREATE TEMPORARY TABLE temp_orders (
+CREATE TEMPORARY TABLE IF NOT EXISTS temp_orders (
     order_id INTEGER,
     user_id INTEGER NOT NULL,
     course_name VARCHAR(255),